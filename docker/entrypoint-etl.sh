@@ -30,8 +30,9 @@ echo "[STARTUP] Recomputing strategy rankings..."
 echo "$(date): Running strategy computation..." >> /var/log/cron.log
 
 cd /app && /usr/local/bin/python -c "
-from src.common.database import SessionLocal
-from src.etl.processors.compute_strategy import run_all_computations
+from src.common.database import SessionLocal, engine
+from src.etl.processors.compute_strategy import ensure_strategy_schema, run_all_computations
+ensure_strategy_schema(engine)
 db = SessionLocal()
 try:
     run_all_computations(db)
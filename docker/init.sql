@@ -28,7 +28,9 @@ CREATE TABLE IF NOT EXISTS institutional_flows (
     UNIQUE(stock_id, trade_date)
 );
 CREATE INDEX IF NOT EXISTS idx_flows_stock_date ON institutional_flows(stock_id, trade_date DESC);
-CREATE INDEX IF NOT EXISTS idx_flows_date ON institutional_flows(trade_date);
+-- INCLUDE 買賣超欄位，讓日期區間查詢 (近 60 日視窗) 可走 index-only scan
+CREATE INDEX IF NOT EXISTS idx_flows_date_stock ON institutional_flows(trade_date, stock_id)
+    INCLUDE (foreign_net, trust_net, dealer_net);
 
 -- 外資持股
 CREATE TABLE IF NOT EXISTS foreign_holdings (
@@ -60,7 +62,9 @@ CREATE TABLE IF NOT EXISTS stock_prices (
     created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
     UNIQUE(stock_id, trade_date)
 );
-CREATE INDEX IF NOT EXISTS idx_prices_stock_date ON stock_prices(stock_id, trade_date DESC);
+-- covering index：出場價 lookup 與技術指標可走 index-only scan
+CREATE INDEX IF NOT EXISTS idx_prices_stock_date_covering ON stock_prices(stock_id, trade_date DESC)
+    INCLUDE (close_price, high_price, low_price);
 CREATE INDEX IF NOT EXISTS idx_prices_date ON stock_prices(trade_date);
 
 -- 計算後的持股比重
@@ -114,6 +118,9 @@ CREATE TABLE IF NOT EXISTS institutional_baselines (
     UNIQUE(stock_id, baseline_date)
 );
 
+-- 策略計算用的 correlation_sufstats 與 materialized views 由
+-- src/etl/processors/compute_strategy.py 建立與維護，不在此重複定義
+
 -- 系統狀態追蹤
 CREATE TABLE IF NOT EXISTS system_status (
     id SERIAL PRIMARY KEY,
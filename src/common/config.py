@@ -38,6 +38,9 @@ class Settings:
     # Data fetching settings
     request_timeout: int = 30
     max_retries: int = 3
+    fetch_cache_dir: str = field(
+        default_factory=lambda: os.environ.get("FETCH_CACHE_DIR", os.path.join("data", "cache"))
+    )
 
     # Analysis windows
     windows: Optional[list] = None
@@ -15,9 +15,13 @@ Base = declarative_base()
 
 
 @contextmanager
-def get_db_session():
-    """Context manager for database sessions."""
-    session = SessionLocal()
+def get_db_session(expire_on_commit: bool = True):
+    """Context manager for database sessions.
+
+    Bulk loaders pass expire_on_commit=False so committing does not expire
+    every object they added to the session.
+    """
+    session = SessionLocal(expire_on_commit=expire_on_commit)
     try:
         yield session
         session.commit()
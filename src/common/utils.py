@@ -1,9 +1,24 @@
 """Shared utility functions for data processing."""
 import re
+import numpy as np
 import pandas as pd
 from datetime import date, timedelta
 from typing import List, Optional
 
+# fastnumbers import with fallback
+try:
+    from fastnumbers import try_float
+    HAS_FASTNUMBERS = True
+except ImportError:
+    HAS_FASTNUMBERS = False
+
+# Valid listed security codes: 4-5 digits, optional uppercase suffix (e.g. 00631L)
+STOCK_CODE_RE = re.compile(r"^\d{4,5}[A-Z]*\Z")
+# Plain numeric codes only (used by the OpenAPI price feeds)
+NUMERIC_CODE_RE = re.compile(r"^\d{4,5}\Z")
+# TWSE CSV wraps codes as ="2330"; strip both characters in a single pass
+CODE_QUOTE_TABLE = str.maketrans("", "", '="')
+
 
 def numeric_series(s: pd.Series) -> pd.Series:
     """
@@ -26,9 +41,29 @@ def numeric_series(s: pd.Series) -> pd.Series:
         return x
 
     cleaned = s.apply(clean)
+    if HAS_FASTNUMBERS:
+        # C-level string -> float parse; unparseable values and None become NaN
+        nan = float('nan')
+        values = try_float(cleaned.tolist(), on_fail=nan, on_type_error=nan, map=True)
+        return pd.Series(values, index=s.index, dtype='float64')
     return pd.to_numeric(cleaned, errors='coerce')
 
 
+def code_mask(codes: pd.Series, pattern: re.Pattern = STOCK_CODE_RE) -> np.ndarray:
+    """
+    Boolean mask of codes matching a precompiled pattern.
+    Iterates the raw object array instead of going through Series.str,
+    which skips the StringMethods dispatch overhead. Missing codes (NaN,
+    None) never match, as with Series.str.match.
+    """
+    values = codes.to_numpy()
+    return np.fromiter(
+        (isinstance(c, str) and pattern.match(c) is not None for c in values),
+        dtype=bool,
+        count=len(values),
+    )
+
+
 def normalize_columns(df: pd.DataFrame) -> pd.DataFrame:
     """
     Flatten MultiIndex columns from TWSE CSV responses.
@@ -41,6 +76,14 @@ def normalize_columns(df: pd.DataFrame) -> pd.DataFrame:
     return df
 
 
+def is_named_column(col: str) -> bool:
+    """
+    read_csv usecols filter that skips the blank trailing column
+    TWSE CSV responses get from their trailing commas.
+    """
+    return not str(col).startswith("Unnamed")
+
+
 def find_col_any(df: pd.DataFrame, *candidates: str) -> Optional[str]:
     """
     Find the first column that contains any of the candidate substrings.
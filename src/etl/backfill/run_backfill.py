@@ -23,6 +23,7 @@ from src.etl.backfill.historical_prices import (
     fetch_tpex_stock_month,
 )
 from src.etl.loaders.db_loader import upsert_stocks
+from src.etl.processors.compute_strategy import invalidate_correlation_sufstats
 
 logging.basicConfig(
     level=logging.INFO,
@@ -443,6 +444,12 @@ def main():
         else:
             backfill_prices_all_stocks(start.year, start.month, end.year, end.month)
 
+    if args.mode in ("flows", "prices", "all"):
+        # 補進的歷史資料早於相關係數累加統計的 last_date，需重建涵蓋這段期間的股票
+        # (價格以整月抓取，從起始月份第一天算起)
+        with get_db_session() as session:
+            invalidate_correlation_sufstats(session, start.replace(day=1))
+
     if args.mode in ("ratios", "all"):
         compute_institutional_ratios(start, end)
 
@@ -16,6 +16,7 @@ from sqlalchemy import text
 from src.common.database import SessionLocal, engine
 from src.etl.fetchers.twse_prices import fetch_twse_stock_day
 from src.etl.fetchers.tpex_prices import fetch_tpex_daily_quotes
+from src.etl.processors.compute_strategy import invalidate_correlation_sufstats
 
 logging.basicConfig(
     level=logging.INFO,
@@ -26,6 +27,10 @@ logger = logging.getLogger(__name__)
 # Thread-local storage for DB sessions
 thread_local = threading.local()
 
+# stock_id -> 最早一筆收盤價被新增或改寫的交易日，回補結束後據此作廢相關係數累加值
+changed_closes = {}
+changed_closes_lock = threading.Lock()
+
 
 def get_thread_db():
     """Get thread-local database session."""
@@ -87,10 +92,36 @@ def get_stock_id_map():
         db.close()
 
 
+def record_changed_close(stock_id: int, trade_date: date):
+    """Remember the earliest trade date whose stored close changed for a stock."""
+    with changed_closes_lock:
+        if stock_id not in changed_closes or trade_date < changed_closes[stock_id]:
+            changed_closes[stock_id] = trade_date
+
+
+def invalidate_changed_correlations():
+    """Have the next strategy run rebuild correlation statistics whose closes changed."""
+    with changed_closes_lock:
+        changed = dict(changed_closes)
+        changed_closes.clear()
+    if not changed:
+        return
+    db = SessionLocal()
+    try:
+        invalidate_correlation_sufstats(db, changed=changed)
+        db.commit()
+    finally:
+        db.close()
+
+
 def upsert_price_record(db, stock_id: int, row: dict):
-    """Upsert a single price record."""
+    """Upsert a single price record, noting it if the stored close changed."""
     try:
         query = text("""
+            WITH old AS (
+                SELECT close_price FROM stock_prices
+                WHERE stock_id = :stock_id AND trade_date = :trade_date
+            )
             INSERT INTO stock_prices (stock_id, trade_date, open_price, high_price,
                                      low_price, close_price, volume, turnover)
             VALUES (:stock_id, :trade_date, :open_price, :high_price,
@@ -102,8 +133,9 @@ def upsert_price_record(db, stock_id: int, row: dict):
                 close_price = EXCLUDED.close_price,
                 volume = EXCLUDED.volume,
                 turnover = EXCLUDED.turnover
+            RETURNING trade_date, close_price IS DISTINCT FROM (SELECT close_price FROM old) AS close_changed
         """)
-        db.execute(query, {
+        result = db.execute(query, {
             "stock_id": stock_id,
             "trade_date": row.get("date"),
             "open_price": row.get("open_price"),
@@ -112,7 +144,9 @@ def upsert_price_record(db, stock_id: int, row: dict):
             "close_price": row.get("close_price"),
             "volume": row.get("volume"),
             "turnover": row.get("turnover"),
-        })
+        }).fetchone()
+        if result.close_changed:
+            record_changed_close(stock_id, result.trade_date)
         return True
     except Exception as e:
         logger.warning(f"Error upserting price: {e}")
@@ -193,6 +227,9 @@ def backfill_twse_parallel(stocks: list, months_back: int = 12, max_workers: int
                 # Close thread-local DB session
                 close_thread_db()
 
+    # 每晚的增量回補會重寫整月資料，只有收盤價真的變動才作廢
+    invalidate_changed_correlations()
+
     return total_records
 
 
@@ -235,6 +272,8 @@ def backfill_tpex_parallel(days_back: int = 365, max_workers: int = 3):
             # Rate limiting between batches
             time.sleep(0.2)
 
+    invalidate_changed_correlations()
+
     return total_records
 
 
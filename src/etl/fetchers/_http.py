@@ -0,0 +1,83 @@
+"""Shared HTTP helpers for TWSE/TPEX fetchers - pooled session and JSON decoding."""
+import time
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+# orjson import with fallback
+try:
+    import orjson
+    HAS_ORJSON = True
+except ImportError:
+    HAS_ORJSON = False
+
+# httpx (with h2 for HTTP/2) import with fallback to requests
+try:
+    import httpx
+    import h2  # noqa: F401 - required by httpx for http2=True
+    HAS_HTTPX = True
+except ImportError:
+    HAS_HTTPX = False
+
+from src.common.config import settings
+
+# 與 requests 路徑的 Retry 設定相同：遇到這些狀態碼以指數退避重試
+RETRY_STATUSES = {502, 503, 504}
+RETRY_BACKOFF = 0.5
+
+
+if HAS_HTTPX:
+    class _RetryingClient(httpx.Client):
+        """httpx client that retries 502/503/504 with backoff like urllib3's Retry.
+
+        HTTPTransport(retries=...) only retries failed connections.
+        """
+
+        def request(self, *args, **kwargs):
+            for attempt in range(settings.max_retries):
+                resp = super().request(*args, **kwargs)
+                if resp.status_code not in RETRY_STATUSES:
+                    return resp
+                resp.close()
+                time.sleep(RETRY_BACKOFF * 2 ** attempt)
+            return super().request(*args, **kwargs)
+
+
+def _build_session():
+    """Create the shared client: HTTP/2 httpx if available, else pooled requests."""
+    if HAS_HTTPX:
+        # One multiplexed connection per origin; get()/params/timeout match requests
+        return _RetryingClient(
+            transport=httpx.HTTPTransport(
+                http2=True,
+                retries=settings.max_retries,
+                limits=httpx.Limits(max_connections=32, max_keepalive_connections=16),
+            ),
+            timeout=settings.request_timeout,
+            follow_redirects=True,
+        )
+
+    session = requests.Session()
+    adapter = HTTPAdapter(
+        pool_connections=16,
+        pool_maxsize=32,
+        max_retries=Retry(
+            total=settings.max_retries,
+            backoff_factor=RETRY_BACKOFF,
+            status_forcelist=list(RETRY_STATUSES),
+        ),
+    )
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    return session
+
+
+SESSION = _build_session()
+
+
+def parse_json(resp):
+    """Decode a JSON response body, using orjson when it is installed."""
+    if HAS_ORJSON:
+        return orjson.loads(resp.content)
+    return resp.json()
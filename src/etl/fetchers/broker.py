@@ -4,7 +4,9 @@
 """
 import re
 import time
+import queue
 import atexit
+import threading
 from datetime import date, datetime
 from typing import Optional, List
 
@@ -79,12 +81,16 @@ def _parse_percent(text: str) -> float:
         return 0.0
 
 
-def fetch_broker_trading(stock_code: str, target_date: Optional[str] = None) -> pd.DataFrame:
+def fetch_broker_trading(
+    stock_code: str, target_date: Optional[str] = None, browser: Optional[Browser] = None
+) -> pd.DataFrame:
     """Fetch broker branch trading data for a specific stock.
 
     Args:
         stock_code: Stock code (e.g., "2330" for TSMC)
         target_date: Target date in "MM/DD" format, None for latest
+        browser: Browser to open the page in (default: the shared singleton);
+            must belong to the calling thread
 
     Returns:
         DataFrame with columns: date, stock_code, broker_name, broker_id,
@@ -93,7 +99,8 @@ def fetch_broker_trading(stock_code: str, target_date: Optional[str] = None) ->
     if not HAS_PLAYWRIGHT:
         raise RuntimeError("Playwright is not installed")
 
-    browser = _get_browser()
+    if browser is None:
+        browser = _get_browser()
     page = browser.new_page()
 
     try:
@@ -207,27 +214,101 @@ def fetch_broker_trading(stock_code: str, target_date: Optional[str] = None) ->
         page.close()
 
 
-def fetch_multiple_stocks(stock_codes: List[str], delay: float = 1.0) -> pd.DataFrame:
+class _RateLimiter:
+    """Space page loads at least `delay` seconds apart across all workers."""
+
+    def __init__(self, delay: float):
+        self.delay = delay
+        self._lock = threading.Lock()
+        self._next_at = 0.0
+
+    def wait(self) -> None:
+        with self._lock:
+            now = time.monotonic()
+            wait = self._next_at - now
+            self._next_at = max(now, self._next_at) + self.delay
+        if wait > 0:
+            time.sleep(wait)
+
+
+def _fetch_worker(codes: "queue.Queue[str]", results: dict, limiter: _RateLimiter) -> None:
+    """Drain codes with a browser owned by this thread, pacing pages through the shared limiter."""
+    # sync API 的物件綁定建立它的執行緒，因此每個 worker 各自啟動並關閉瀏覽器
+    try:
+        with sync_playwright() as playwright:
+            browser = playwright.chromium.launch(headless=True)
+            try:
+                while True:
+                    try:
+                        code = codes.get_nowait()
+                    except queue.Empty:
+                        return
+                    limiter.wait()
+                    try:
+                        results[code] = fetch_broker_trading(code, browser=browser)
+                    except Exception as e:
+                        print(f"Error fetching broker data for {code}: {e}")
+            finally:
+                browser.close()
+    except Exception as e:
+        # 瀏覽器啟動失敗時剩下的股票仍留在佇列，由其他 worker 或結束後的補抓處理
+        print(f"Broker worker {threading.current_thread().name} stopped: {e}")
+
+
+def fetch_multiple_stocks(stock_codes: List[str], delay: float = 1.0, max_workers: int = 1) -> pd.DataFrame:
     """Fetch broker trading data for multiple stocks.
 
+    The pages are JavaScript-rendered, so by default one shared headless
+    browser loads them one by one. With max_workers > 1 each worker drives
+    its own browser, but delay is still enforced between any two page loads
+    so the site sees the same request rate; stocks left over by workers
+    whose browser failed to start are fetched sequentially afterwards.
+
     Args:
         stock_codes: List of stock codes
         delay: Delay between requests in seconds
+        max_workers: Number of browsers fetching concurrently (opt-in)
 
     Returns:
-        Combined DataFrame with all broker trading data
+        Combined DataFrame with all broker trading data, in stock_codes order
     """
-    all_data = []
-
-    for code in stock_codes:
+    if max_workers <= 1:
+        remaining = list(stock_codes)
+        results: dict = {}
+    else:
+        if not HAS_PLAYWRIGHT:
+            raise RuntimeError("Playwright is not installed")
+
+        codes: "queue.Queue[str]" = queue.Queue()
+        for code in stock_codes:
+            codes.put(code)
+        results = {}
+        limiter = _RateLimiter(delay)
+
+        workers = [
+            threading.Thread(target=_fetch_worker, args=(codes, results, limiter), name=f"broker-{i}")
+            for i in range(min(max_workers, len(stock_codes)))
+        ]
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
+
+        remaining = []
+        while not codes.empty():
+            remaining.append(codes.get_nowait())
+        if remaining:
+            print(f"Fetching {len(remaining)} stocks left by failed broker workers sequentially")
+
+    for code in remaining:
         try:
-            df = fetch_broker_trading(code)
-            all_data.append(df)
+            results[code] = fetch_broker_trading(code)
             time.sleep(delay)
         except Exception as e:
             print(f"Error fetching broker data for {code}: {e}")
             continue
 
+    all_data = [results[code] for code in stock_codes if code in results]
     if all_data:
         return pd.concat(all_data, ignore_index=True)
     return pd.DataFrame()
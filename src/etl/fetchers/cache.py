@@ -0,0 +1,52 @@
+"""On-disk cache of per-date fetcher results, keyed by (source, trade_date)."""
+import hashlib
+import inspect
+import os
+import sys
+import threading
+from datetime import date
+from functools import lru_cache
+from typing import Callable, Optional
+import pandas as pd
+
+from src.common.config import settings
+
+
+@lru_cache(maxsize=None)
+def _module_version(module_name: str) -> str:
+    """Short hash of a fetcher module's source, so editing a parser invalidates its files."""
+    source = inspect.getsource(sys.modules[module_name])
+    return hashlib.sha1(source.encode("utf-8")).hexdigest()[:8]
+
+
+def cache_path(source: str, fetcher: Callable, trade_date: date) -> str:
+    """Path of the cached frame for one source and date."""
+    version = _module_version(fetcher.__module__)
+    return os.path.join(settings.fetch_cache_dir, source, f"{trade_date:%Y%m%d}-{version}.pkl")
+
+
+def read_cached(source: str, fetcher: Callable, trade_date: date) -> Optional[pd.DataFrame]:
+    """Return the cached frame, or None on a miss or an unreadable file."""
+    path = cache_path(source, fetcher, trade_date)
+    if not os.path.exists(path):
+        return None
+    try:
+        return pd.read_pickle(path)
+    except Exception:
+        return None
+
+
+def write_cached(source: str, fetcher: Callable, trade_date: date, df: pd.DataFrame) -> None:
+    """Store a fetched frame.
+
+    Empty frames are not stored: they usually mean the exchange has not
+    published that date yet, and a later run should ask again.
+    """
+    if df.empty:
+        return
+    path = cache_path(source, fetcher, trade_date)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    # 先寫暫存檔再改名，並行寫入或中斷時不會留下半個檔案
+    tmp_path = f"{path}.{os.getpid()}-{threading.get_ident()}.tmp"
+    df.to_pickle(tmp_path)
+    os.replace(tmp_path, path)
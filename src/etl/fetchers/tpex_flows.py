@@ -1,11 +1,11 @@
 """TPEX 三大法人買賣明細 fetcher."""
 from datetime import date
 from io import StringIO
-import requests
 import pandas as pd
 
-from src.common.utils import numeric_series, normalize_columns, find_col_any, to_roc_date
+from src.common.utils import numeric_series, normalize_columns, find_col_any, to_roc_date, code_mask
 from src.common.config import settings
+from src.etl.fetchers._http import SESSION
 
 
 def fetch_tpex_flows(trade_date: date) -> pd.DataFrame:
@@ -30,7 +30,7 @@ def fetch_tpex_flows(trade_date: date) -> pd.DataFrame:
     )
 
     try:
-        resp = requests.get(url, params=params, timeout=settings.request_timeout)
+        resp = SESSION.get(url, params=params, timeout=settings.request_timeout)
         resp.encoding = "utf-8"
         tables = pd.read_html(StringIO(resp.text))
     except Exception:
@@ -78,5 +78,5 @@ def fetch_tpex_flows(trade_date: date) -> pd.DataFrame:
         "market": "TPEX",
     })
 
-    mask = out["code"].str.match(r"^\d{4,5}[A-Z]*$")
+    mask = code_mask(out["code"])
     return out[mask].reset_index(drop=True)
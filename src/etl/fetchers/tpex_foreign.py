@@ -1,11 +1,11 @@
 """TPEX QFII - 僑外資及陸資持股統計 fetcher."""
 from datetime import date
 from io import StringIO
-import requests
 import pandas as pd
 
-from src.common.utils import numeric_series, normalize_columns, find_col_any
+from src.common.utils import numeric_series, normalize_columns, find_col_any, code_mask
 from src.common.config import settings
+from src.etl.fetchers._http import SESSION
 
 
 def fetch_tpex_qfii(trade_date: date) -> pd.DataFrame:
@@ -25,7 +25,7 @@ def fetch_tpex_qfii(trade_date: date) -> pd.DataFrame:
     ])
 
     try:
-        resp = requests.get(url, params=params, timeout=settings.request_timeout)
+        resp = SESSION.get(url, params=params, timeout=settings.request_timeout)
         resp.encoding = "utf-8"
         df = pd.read_csv(StringIO(resp.text))
     except Exception:
@@ -51,7 +51,7 @@ def fetch_tpex_qfii(trade_date: date) -> pd.DataFrame:
     out["code"] = df[code_col].astype(str).str.strip().str.zfill(4)
     out["name"] = df[name_col].astype(str).str.strip()
 
-    mask = out["code"].str.match(r"^\d{4,5}[A-Z]*$")
+    mask = code_mask(out["code"])
     out = out[mask].copy()
 
     if out.empty:
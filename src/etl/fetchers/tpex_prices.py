@@ -1,10 +1,11 @@
 """TPEX Stock Price fetcher - 上櫃股票每日收盤行情."""
 from datetime import date
-import requests
+import numpy as np
 import pandas as pd
 
-from src.common.utils import to_roc_date
+from src.common.utils import to_roc_date, code_mask, NUMERIC_CODE_RE
 from src.common.config import settings
+from src.etl.fetchers._http import SESSION, parse_json
 
 
 def fetch_tpex_quotes() -> pd.DataFrame:
@@ -22,9 +23,9 @@ def fetch_tpex_quotes() -> pd.DataFrame:
     ])
 
     try:
-        resp = requests.get(url, timeout=settings.request_timeout)
+        resp = SESSION.get(url, timeout=settings.request_timeout)
         resp.raise_for_status()
-        data = resp.json()
+        data = parse_json(resp)
     except Exception:
         return empty_result
 
@@ -80,7 +81,7 @@ def fetch_tpex_quotes() -> pd.DataFrame:
     # Filter valid stock codes
     if "code" in df.columns:
         df["code"] = df["code"].astype(str).str.strip()
-        mask = df["code"].str.match(r"^\d{4,5}$")
+        mask = code_mask(df["code"], NUMERIC_CODE_RE)
         df = df[mask].copy()
 
     df["market"] = "TPEX"
@@ -119,9 +120,9 @@ def fetch_tpex_daily_quotes(trade_date: date) -> pd.DataFrame:
     ])
 
     try:
-        resp = requests.get(url, params=params, timeout=settings.request_timeout)
+        resp = SESSION.get(url, params=params, timeout=settings.request_timeout)
         resp.raise_for_status()
-        data = resp.json()
+        data = parse_json(resp)
     except Exception:
         return empty_result
 
@@ -157,23 +158,37 @@ def fetch_tpex_daily_quotes(trade_date: date) -> pd.DataFrame:
                 volume_idx, turnover_idx = 7, 8
                 turnover_multiplier = 1000  # Was in thousands
 
-            rows.append({
-                "date": trade_date,
-                "code": code,
-                "name": str(row[1]).strip(),
-                "market": "TPEX",
-                "close_price": float(str(row[2]).replace(",", "")) if row[2] not in ("--", "") else None,
-                "change_amount": float(str(row[3]).replace(",", "").replace("－", "-")) if row[3] not in ("--", "") else None,
-                "open_price": float(str(row[4]).replace(",", "")) if row[4] not in ("--", "") else None,
-                "high_price": float(str(row[5]).replace(",", "")) if row[5] not in ("--", "") else None,
-                "low_price": float(str(row[6]).replace(",", "")) if row[6] not in ("--", "") else None,
-                "volume": int(str(row[volume_idx]).replace(",", "")) if row[volume_idx] not in ("--", "") else None,
-                "turnover": int(float(str(row[turnover_idx]).replace(",", "")) * turnover_multiplier) if row[turnover_idx] not in ("--", "") else None,
-            })
+            rows.append((
+                code,
+                str(row[1]).strip(),
+                float(str(row[2]).replace(",", "")) if row[2] not in ("--", "") else None,
+                float(str(row[3]).replace(",", "").replace("－", "-")) if row[3] not in ("--", "") else None,
+                float(str(row[4]).replace(",", "")) if row[4] not in ("--", "") else None,
+                float(str(row[5]).replace(",", "")) if row[5] not in ("--", "") else None,
+                float(str(row[6]).replace(",", "")) if row[6] not in ("--", "") else None,
+                int(str(row[volume_idx]).replace(",", "")) if row[volume_idx] not in ("--", "") else None,
+                int(float(str(row[turnover_idx]).replace(",", "")) * turnover_multiplier) if row[turnover_idx] not in ("--", "") else None,
+            ))
         except (ValueError, IndexError):
             continue
 
     if not rows:
         return empty_result
 
-    return pd.DataFrame(rows)
+    # Transpose parsed rows into columns so pandas builds each array directly
+    (codes, names, closes, changes, opens, highs, lows,
+     volumes, turnovers) = zip(*rows)
+
+    return pd.DataFrame({
+        "date": trade_date,
+        "code": codes,
+        "name": names,
+        "market": "TPEX",
+        "close_price": np.asarray(closes, dtype="float64"),
+        "change_amount": np.asarray(changes, dtype="float64"),
+        "open_price": np.asarray(opens, dtype="float64"),
+        "high_price": np.asarray(highs, dtype="float64"),
+        "low_price": np.asarray(lows, dtype="float64"),
+        "volume": list(volumes),
+        "turnover": list(turnovers),
+    })
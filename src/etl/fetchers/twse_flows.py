@@ -1,11 +1,11 @@
 """TWSE T86 - 三大法人買賣超統計資訊 fetcher."""
 from datetime import date
 from io import StringIO
-import requests
 import pandas as pd
 
-from src.common.utils import numeric_series, normalize_columns, find_col_any
+from src.common.utils import numeric_series, normalize_columns, find_col_any, code_mask, CODE_QUOTE_TABLE, is_named_column
 from src.common.config import settings
+from src.etl.fetchers._http import SESSION
 
 
 def fetch_twse_t86(trade_date: date) -> pd.DataFrame:
@@ -24,12 +24,11 @@ def fetch_twse_t86(trade_date: date) -> pd.DataFrame:
         "selectType": "ALLBUT0999",
     }
 
-    resp = requests.get(url, params=params, timeout=settings.request_timeout)
+    resp = SESSION.get(url, params=params, timeout=settings.request_timeout)
     csv_text = resp.content.decode("cp950", errors="ignore")
 
-    df = pd.read_csv(StringIO(csv_text), header=1)
+    df = pd.read_csv(StringIO(csv_text), header=1, usecols=is_named_column)
     df = df.dropna(how="all", axis=0)
-    df = df.dropna(how="all", axis=1)
     df = normalize_columns(df)
 
     empty_result = pd.DataFrame(
@@ -54,7 +53,7 @@ def fetch_twse_t86(trade_date: date) -> pd.DataFrame:
     if not all([code_col, name_col, col_foreign_ex_net, col_trust_net, col_dealer_net]):
         return empty_result
 
-    df["code"] = df[code_col].astype(str).str.replace("=", "").str.replace('"', "")
+    df["code"] = df[code_col].astype(str).str.translate(CODE_QUOTE_TABLE)
     df["code"] = df["code"].str.strip().str.zfill(4)
     df["name"] = df[name_col].astype(str).str.strip()
 
@@ -74,5 +73,5 @@ def fetch_twse_t86(trade_date: date) -> pd.DataFrame:
     })
 
     # Filter valid stock codes
-    mask = out["code"].str.match(r"^\d{4,5}[A-Z]*$")
+    mask = code_mask(out["code"])
     return out[mask].reset_index(drop=True)
@@ -1,11 +1,11 @@
 """TWSE MI_QFIIS - 外資及陸資投資持股統計 fetcher."""
 from datetime import date
 from io import StringIO
-import requests
 import pandas as pd
 
-from src.common.utils import numeric_series, normalize_columns, find_col_any
+from src.common.utils import numeric_series, normalize_columns, find_col_any, code_mask, CODE_QUOTE_TABLE, is_named_column
 from src.common.config import settings
+from src.etl.fetchers._http import SESSION
 
 
 def fetch_twse_mi_qfiis(trade_date: date) -> pd.DataFrame:
@@ -28,16 +28,15 @@ def fetch_twse_mi_qfiis(trade_date: date) -> pd.DataFrame:
         "date", "code", "name", "market", "total_shares", "foreign_shares", "foreign_ratio"
     ])
 
-    resp = requests.get(url, params=params, timeout=settings.request_timeout)
+    resp = SESSION.get(url, params=params, timeout=settings.request_timeout)
     csv_text = resp.content.decode("cp950", errors="ignore")
 
     try:
-        df = pd.read_csv(StringIO(csv_text), header=1)
+        df = pd.read_csv(StringIO(csv_text), header=1, usecols=is_named_column)
     except Exception:
         return empty_result
 
     df = df.dropna(how="all", axis=0)
-    df = df.dropna(how="all", axis=1)
     df = normalize_columns(df)
 
     if df.empty or len(df.columns) == 0:
@@ -53,10 +52,10 @@ def fetch_twse_mi_qfiis(trade_date: date) -> pd.DataFrame:
         return empty_result
 
     out = pd.DataFrame()
-    out["code"] = df[code_col].astype(str).str.replace("=", "").str.replace('"', "").str.strip().str.zfill(4)
+    out["code"] = df[code_col].astype(str).str.translate(CODE_QUOTE_TABLE).str.strip().str.zfill(4)
     out["name"] = df[name_col].astype(str).str.strip()
 
-    mask = out["code"].str.match(r"^\d{4,5}[A-Z]*$")
+    mask = code_mask(out["code"])
     out = out[mask].copy()
 
     if out.empty:
@@ -1,9 +1,11 @@
 """TWSE Stock Price fetcher - 每日收盤行情."""
 from datetime import date
-import requests
+import numpy as np
 import pandas as pd
 
+from src.common.utils import code_mask, NUMERIC_CODE_RE
 from src.common.config import settings
+from src.etl.fetchers._http import SESSION, parse_json
 
 
 def fetch_twse_stock_day_all() -> pd.DataFrame:
@@ -21,9 +23,9 @@ def fetch_twse_stock_day_all() -> pd.DataFrame:
     ])
 
     try:
-        resp = requests.get(url, timeout=settings.request_timeout)
+        resp = SESSION.get(url, timeout=settings.request_timeout)
         resp.raise_for_status()
-        data = resp.json()
+        data = parse_json(resp)
     except Exception:
         return empty_result
 
@@ -60,7 +62,7 @@ def fetch_twse_stock_day_all() -> pd.DataFrame:
 
     # Filter valid stock codes (4-5 digits)
     df["code"] = df["code"].astype(str).str.strip()
-    mask = df["code"].str.match(r"^\d{4,5}$")
+    mask = code_mask(df["code"], NUMERIC_CODE_RE)
     df = df[mask].copy()
 
     df["market"] = "TWSE"
@@ -100,9 +102,9 @@ def fetch_twse_stock_day(stock_code: str, trade_date: date) -> pd.DataFrame:
     ])
 
     try:
-        resp = requests.get(url, params=params, timeout=settings.request_timeout)
+        resp = SESSION.get(url, params=params, timeout=settings.request_timeout)
         resp.raise_for_status()
-        data = resp.json()
+        data = parse_json(resp)
     except Exception:
         return empty_result
 
@@ -120,22 +122,36 @@ def fetch_twse_stock_day(stock_code: str, trade_date: date) -> pd.DataFrame:
             day = int(date_parts[2])
             trade_dt = date(year, month, day)
 
-            rows.append({
-                "date": trade_dt,
-                "code": stock_code,
-                "volume": int(row[1].replace(",", "")),
-                "turnover": int(row[2].replace(",", "")),
-                "open_price": float(row[3].replace(",", "")) if row[3] != "--" else None,
-                "high_price": float(row[4].replace(",", "")) if row[4] != "--" else None,
-                "low_price": float(row[5].replace(",", "")) if row[5] != "--" else None,
-                "close_price": float(row[6].replace(",", "")) if row[6] != "--" else None,
-                "change_amount": float(row[7].replace(",", "").replace("+", "")) if row[7] not in ("--", "X") else None,
-                "transactions": int(row[8].replace(",", "")),
-            })
+            rows.append((
+                trade_dt,
+                int(row[1].replace(",", "")),
+                int(row[2].replace(",", "")),
+                float(row[3].replace(",", "")) if row[3] != "--" else None,
+                float(row[4].replace(",", "")) if row[4] != "--" else None,
+                float(row[5].replace(",", "")) if row[5] != "--" else None,
+                float(row[6].replace(",", "")) if row[6] != "--" else None,
+                float(row[7].replace(",", "").replace("+", "")) if row[7] not in ("--", "X") else None,
+                int(row[8].replace(",", "")),
+            ))
         except (ValueError, IndexError):
             continue
 
     if not rows:
         return empty_result
 
-    return pd.DataFrame(rows)
+    # Transpose parsed rows into columns so pandas builds each array directly
+    (dates, volumes, turnovers, opens, highs, lows, closes,
+     changes, transactions) = zip(*rows)
+
+    return pd.DataFrame({
+        "date": dates,
+        "code": stock_code,
+        "volume": np.asarray(volumes, dtype="int64"),
+        "turnover": np.asarray(turnovers, dtype="int64"),
+        "open_price": np.asarray(opens, dtype="float64"),
+        "high_price": np.asarray(highs, dtype="float64"),
+        "low_price": np.asarray(lows, dtype="float64"),
+        "close_price": np.asarray(closes, dtype="float64"),
+        "change_amount": np.asarray(changes, dtype="float64"),
+        "transactions": np.asarray(transactions, dtype="int64"),
+    })
@@ -5,5 +5,9 @@ from .db_loader import (
     upsert_prices,
     upsert_ratios,
     upsert_broker_trades,
+    sync_baselines,
     get_or_create_stock,
+    prime_stock_cache,
+    clear_stock_cache,
+    get_last_trade_date,
 )
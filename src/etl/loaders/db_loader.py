@@ -1,15 +1,141 @@
 """Database loader functions - upsert data to PostgreSQL."""
+import csv
+import io
 from datetime import date
-from typing import Dict, Optional
+from typing import Dict, List, Optional
+import numpy as np
 import pandas as pd
+from sqlalchemy import text
 from sqlalchemy.dialects.postgresql import insert
 from sqlalchemy.orm import Session
 
 from src.common.database import get_db_session
-from src.common.models import (
-    Stock, InstitutionalFlow, ForeignHolding, StockPrice,
-    InstitutionalRatio, BrokerTrade, InstitutionalBaseline
-)
+from src.common.models import Stock, BrokerTrade, InstitutionalBaseline
+
+
+PRICE_FLOAT_COLS = ["open_price", "high_price", "low_price", "close_price", "change_amount", "change_percent"]
+PRICE_INT_COLS = ["volume", "turnover", "transactions"]
+
+STOCK_UPDATE_COLS = ["name", "market", "total_shares"]
+FLOW_UPDATE_COLS = ["foreign_net", "trust_net", "dealer_net"]
+HOLDING_UPDATE_COLS = ["total_shares", "foreign_shares", "foreign_ratio"]
+PRICE_UPDATE_COLS = PRICE_FLOAT_COLS + PRICE_INT_COLS
+RATIO_FLOAT_COLS = [
+    "foreign_ratio", "trust_ratio_est", "dealer_ratio_est", "three_inst_ratio_est",
+    "change_5d", "change_20d", "change_60d", "change_120d",
+]
+RATIO_INT_COLS = ["trust_shares_est", "dealer_shares_est"]
+RATIO_UPDATE_COLS = RATIO_FLOAT_COLS + RATIO_INT_COLS
+BROKER_INT_COLS = ["buy_vol", "sell_vol", "net_vol", "rank"]
+BASELINE_INT_COLS = ["trust_shares_base", "dealer_shares_base"]
+
+
+def _upsert_stmt(model, update_cols: List[str], index_elements: List[str]):
+    """Build a reusable INSERT .. ON CONFLICT DO UPDATE statement for executemany."""
+    stmt = insert(model)
+    return stmt.on_conflict_do_update(
+        index_elements=index_elements,
+        set_={col: stmt.excluded[col] for col in update_cols},
+    )
+
+
+# Built once so SQLAlchemy compiles each statement a single time
+STOCK_UPSERT = _upsert_stmt(Stock, STOCK_UPDATE_COLS, ["code"])
+BASELINE_UPSERT = _upsert_stmt(InstitutionalBaseline, BASELINE_INT_COLS, ["stock_id", "baseline_date"])
+
+# table -> system_status key holding the latest trade_date the upserters wrote
+WATERMARK_KEYS = {
+    "institutional_flows": "flows_last_date",
+    "foreign_holdings": "foreign_last_date",
+    "stock_prices": "prices_last_date",
+}
+# 以日期比較 (而非字串)；GREATEST 讓較舊日期的補資料不會把 watermark 往回拉
+WATERMARK_UPSERT = text("""
+    INSERT INTO system_status (status_key, status_value, updated_at)
+    VALUES (:key, :value, CURRENT_TIMESTAMP)
+    ON CONFLICT (status_key) DO UPDATE SET
+        status_value = CAST(GREATEST(
+            CAST(system_status.status_value AS date), CAST(EXCLUDED.status_value AS date)
+        ) AS text),
+        updated_at = CURRENT_TIMESTAMP
+""")
+WATERMARK_SELECT = text("SELECT status_value FROM system_status WHERE status_key = :key")
+
+
+def _to_nullable_records(
+    df: pd.DataFrame,
+    float_cols: List[str],
+    int_cols: List[str],
+    fill_value: Optional[int] = None,
+) -> List[dict]:
+    """Cast numeric columns to nullable dtypes and return row dicts with NaN mapped to None.
+
+    Missing columns are added as all-NA. Integer columns are truncated like int().
+    If fill_value is given, missing numeric values are filled with it instead of None.
+    """
+    df = df.reindex(columns=list(dict.fromkeys([*df.columns, *float_cols, *int_cols])))
+    if float_cols:
+        df[float_cols] = df[float_cols].apply(pd.to_numeric, errors="coerce").astype("Float64")
+    if int_cols:
+        df[int_cols] = df[int_cols].apply(pd.to_numeric, errors="coerce").apply(np.trunc).astype("Int64")
+    if fill_value is not None:
+        df[float_cols + int_cols] = df[float_cols + int_cols].fillna(fill_value)
+    return df.astype(object).where(df.notna(), None).to_dict("records")
+
+
+# Process-wide stock code -> id cache shared across upsert calls.
+# Entries are only added after the session that resolved them has committed.
+_STOCK_ID_CACHE: Dict[str, int] = {}
+
+
+def prime_stock_cache() -> int:
+    """Load every stock code -> id into the process-wide cache.
+
+    Returns:
+        Number of cached stocks
+    """
+    with get_db_session() as session:
+        rows = session.query(Stock.code, Stock.id).all()
+    _STOCK_ID_CACHE.update({code: stock_id for code, stock_id in rows})
+    return len(rows)
+
+
+def clear_stock_cache() -> None:
+    """Drop all cached stock ids (e.g. after stocks were deleted)."""
+    _STOCK_ID_CACHE.clear()
+
+
+def _advance_watermark(session: Session, table: str, trade_dates) -> None:
+    """Move table's last-date watermark forward within the caller's transaction."""
+    if trade_dates:
+        # 來源可能混有 date 與 pd.Timestamp，統一成 date 才存成 YYYY-MM-DD
+        last = max(pd.Timestamp(d).date() for d in trade_dates)
+        session.execute(WATERMARK_UPSERT, {"key": WATERMARK_KEYS[table], "value": last.isoformat()})
+
+
+def get_last_trade_date(table: str) -> Optional[date]:
+    """Get the latest trade_date written to a flows/holdings/prices table.
+
+    Reads the system_status watermark the upserters keep in the same
+    transaction as their rows. Without one (fresh deployment, or data loaded
+    by other tools), falls back to MAX(trade_date) and stores the result.
+
+    Args:
+        table: A key of WATERMARK_KEYS
+
+    Returns:
+        Latest trade date, or None if the table is empty
+    """
+    with get_db_session() as session:
+        value = session.execute(WATERMARK_SELECT, {"key": WATERMARK_KEYS[table]}).scalar()
+        if value is not None:
+            # 舊版可能存成 YYYY-MM-DDT00:00:00
+            return pd.Timestamp(value).date()
+
+        last = session.execute(text(f"SELECT MAX(trade_date) FROM {table}")).scalar()
+        if last is not None:
+            _advance_watermark(session, table, [last])
+        return last
 
 
 def get_or_create_stock(session: Session, code: str, name: str, market: str, total_shares: Optional[int] = None) -> Stock:
@@ -40,27 +166,21 @@ def upsert_stocks(df: pd.DataFrame) -> int:
     if df.empty:
         return 0
 
-    count = 0
+    # Keyed by code so duplicates collapse to the last row, as per-row upserts did
+    params: Dict[str, dict] = {}
+    for row in _to_nullable_records(df, [], ["total_shares"]):
+        code = str(row["code"]).strip()
+        params[code] = dict(
+            code=code,
+            name=str(row.get("name") or "").strip(),
+            market=str(row.get("market") or "TWSE").strip(),
+            total_shares=row["total_shares"],
+        )
+
     with get_db_session() as session:
-        for _, row in df.iterrows():
-            code = str(row["code"]).strip()
-            name = str(row.get("name", "")).strip()
-            market = str(row.get("market", "TWSE")).strip()
-            total_shares = int(row["total_shares"]) if pd.notna(row.get("total_shares")) else None
-
-            stmt = insert(Stock).values(
-                code=code,
-                name=name,
-                market=market,
-                total_shares=total_shares
-            ).on_conflict_do_update(
-                index_elements=["code"],
-                set_=dict(name=name, market=market, total_shares=total_shares)
-            )
-            session.execute(stmt)
-            count += 1
+        session.execute(STOCK_UPSERT, list(params.values()))
 
-    return count
+    return len(params)
 
 
 def upsert_flows(df: pd.DataFrame) -> int:
@@ -74,41 +194,39 @@ def upsert_flows(df: pd.DataFrame) -> int:
     if df.empty:
         return 0
 
-    count = 0
-    with get_db_session() as session:
+    records = _to_nullable_records(df, [], FLOW_UPDATE_COLS, fill_value=0)
+
+    with get_db_session(expire_on_commit=False) as session:
         # Build stock code to id mapping
         stock_map: Dict[str, int] = {}
+        params: Dict[tuple, dict] = {}
 
-        for _, row in df.iterrows():
+        for row in records:
             code = str(row["code"]).strip()
             trade_date = row["date"] if isinstance(row["date"], date) else pd.to_datetime(row["date"]).date()
 
             if code not in stock_map:
-                name = str(row.get("name", "")).strip() or code
-                market = str(row.get("market", "TWSE")).strip()
-                stock = get_or_create_stock(session, code, name, market)
-                stock_map[code] = stock.id
+                stock_id = _STOCK_ID_CACHE.get(code)
+                if stock_id is None:
+                    name = str(row.get("name") or "").strip() or code
+                    market = str(row.get("market") or "TWSE").strip()
+                    stock_id = get_or_create_stock(session, code, name, market).id
+                stock_map[code] = stock_id
 
             stock_id = stock_map[code]
-
-            stmt = insert(InstitutionalFlow).values(
+            params[(stock_id, trade_date)] = dict(
                 stock_id=stock_id,
                 trade_date=trade_date,
-                foreign_net=int(row.get("foreign_net", 0) or 0),
-                trust_net=int(row.get("trust_net", 0) or 0),
-                dealer_net=int(row.get("dealer_net", 0) or 0),
-            ).on_conflict_do_update(
-                index_elements=["stock_id", "trade_date"],
-                set_=dict(
-                    foreign_net=int(row.get("foreign_net", 0) or 0),
-                    trust_net=int(row.get("trust_net", 0) or 0),
-                    dealer_net=int(row.get("dealer_net", 0) or 0),
-                )
+                foreign_net=row["foreign_net"],
+                trust_net=row["trust_net"],
+                dealer_net=row["dealer_net"],
             )
-            session.execute(stmt)
-            count += 1
 
-    return count
+        _copy_upsert(session, "institutional_flows", list(params.values()), FLOW_UPDATE_COLS)
+        _advance_watermark(session, "institutional_flows", [key[1] for key in params])
+
+    _STOCK_ID_CACHE.update(stock_map)
+    return len(params)
 
 
 def upsert_foreign_holdings(df: pd.DataFrame) -> int:
@@ -122,46 +240,83 @@ def upsert_foreign_holdings(df: pd.DataFrame) -> int:
     if df.empty:
         return 0
 
-    count = 0
-    with get_db_session() as session:
+    records = _to_nullable_records(df, ["foreign_ratio"], ["total_shares", "foreign_shares"])
+
+    with get_db_session(expire_on_commit=False) as session:
         stock_map: Dict[str, int] = {}
+        params: Dict[tuple, dict] = {}
 
-        for _, row in df.iterrows():
+        for row in records:
             code = str(row["code"]).strip()
             trade_date = row["date"] if isinstance(row["date"], date) else pd.to_datetime(row["date"]).date()
 
             if code not in stock_map:
-                name = str(row.get("name", "")).strip() or code
-                market = str(row.get("market", "TWSE")).strip()
-                total_shares = int(row["total_shares"]) if pd.notna(row.get("total_shares")) else None
-                stock = get_or_create_stock(session, code, name, market, total_shares)
+                name = str(row.get("name") or "").strip() or code
+                market = str(row.get("market") or "TWSE").strip()
+                stock = get_or_create_stock(session, code, name, market, row["total_shares"])
                 stock_map[code] = stock.id
 
             stock_id = stock_map[code]
 
-            # Handle NaN values properly
-            total_shares = int(row["total_shares"]) if pd.notna(row.get("total_shares")) else 0
-            foreign_shares = int(row["foreign_shares"]) if pd.notna(row.get("foreign_shares")) else 0
-            foreign_ratio = float(row["foreign_ratio"]) if pd.notna(row.get("foreign_ratio")) else 0.0
-
-            stmt = insert(ForeignHolding).values(
+            # Missing holdings are stored as zero rather than NULL
+            params[(stock_id, trade_date)] = dict(
                 stock_id=stock_id,
                 trade_date=trade_date,
-                total_shares=total_shares,
-                foreign_shares=foreign_shares,
-                foreign_ratio=foreign_ratio,
-            ).on_conflict_do_update(
-                index_elements=["stock_id", "trade_date"],
-                set_=dict(
-                    total_shares=total_shares,
-                    foreign_shares=foreign_shares,
-                    foreign_ratio=foreign_ratio,
-                )
+                total_shares=row["total_shares"] or 0,
+                foreign_shares=row["foreign_shares"] or 0,
+                foreign_ratio=row["foreign_ratio"] or 0.0,
             )
-            session.execute(stmt)
-            count += 1
 
-    return count
+        _copy_upsert(session, "foreign_holdings", list(params.values()), HOLDING_UPDATE_COLS)
+        _advance_watermark(session, "foreign_holdings", [key[1] for key in params])
+
+    _STOCK_ID_CACHE.update(stock_map)
+    return len(params)
+
+
+def _prices_exist_for_dates(session: Session, trade_dates: List[date]) -> bool:
+    """Check whether any stock_prices row already exists for the given dates."""
+    query = text("SELECT 1 FROM stock_prices WHERE trade_date = ANY(:dates) LIMIT 1")
+    return session.execute(query, {"dates": trade_dates}).first() is not None
+
+
+def _copy_rows(session: Session, table: str, columns: List[str], rows: List[dict]) -> None:
+    """Bulk load row dicts with COPY FROM STDIN (no conflict handling)."""
+    buf = io.StringIO()
+    writer = csv.writer(buf)
+    for row in rows:
+        writer.writerow([row[col] for col in columns])
+    buf.seek(0)
+
+    raw = session.connection().connection
+    with raw.cursor() as cur:
+        cur.copy_expert(
+            f"COPY {table} ({', '.join(columns)}) FROM STDIN WITH (FORMAT csv, NULL '')",
+            buf,
+        )
+
+
+def _copy_upsert(session: Session, table: str, rows: List[dict], update_cols: List[str]) -> None:
+    """Upsert (stock_id, trade_date)-keyed rows via a COPY-loaded staging table.
+
+    Rows are streamed into a temp table with COPY, then merged with a single
+    INSERT .. SELECT .. ON CONFLICT DO UPDATE. Keys must be unique in rows.
+    """
+    columns = ["stock_id", "trade_date", *update_cols]
+    column_list = ", ".join(columns)
+    staging = f"{table}_staging"
+
+    session.execute(text(
+        f"CREATE TEMP TABLE {staging} ON COMMIT DROP AS "
+        f"SELECT {column_list} FROM {table} WITH NO DATA"
+    ))
+    _copy_rows(session, staging, columns, rows)
+    session.execute(text(f"""
+        INSERT INTO {table} ({column_list})
+        SELECT {column_list} FROM {staging}
+        ON CONFLICT (stock_id, trade_date) DO UPDATE SET
+            {", ".join(f"{col} = EXCLUDED.{col}" for col in update_cols)}
+    """))
 
 
 def upsert_prices(df: pd.DataFrame) -> int:
@@ -169,149 +324,150 @@ def upsert_prices(df: pd.DataFrame) -> int:
 
     Expected columns: date, code, open_price, high_price, low_price, close_price, volume, turnover, ...
 
+    When none of the trade dates are in the table yet (first load of a day or
+    a fresh backfill), rows are COPYed straight into the table; otherwise they
+    go through a staging table and INSERT..ON CONFLICT.
+
     Returns:
         Number of prices upserted
     """
     if df.empty:
         return 0
 
-    count = 0
-    with get_db_session() as session:
+    records = _to_nullable_records(df, PRICE_FLOAT_COLS, PRICE_INT_COLS)
+
+    with get_db_session(expire_on_commit=False) as session:
         stock_map: Dict[str, int] = {}
+        # Keyed by (stock_id, trade_date) so duplicates collapse like an upsert would
+        rows: Dict[tuple, dict] = {}
 
-        for _, row in df.iterrows():
+        for row in records:
             code = str(row["code"]).strip()
             trade_date = row["date"] if isinstance(row["date"], date) else pd.to_datetime(row["date"]).date()
 
             if code not in stock_map:
-                name = str(row.get("name", "")).strip() or code
-                market = str(row.get("market", "TWSE")).strip()
-                stock = get_or_create_stock(session, code, name, market)
-                stock_map[code] = stock.id
+                stock_id = _STOCK_ID_CACHE.get(code)
+                if stock_id is None:
+                    name = str(row.get("name") or "").strip() or code
+                    market = str(row.get("market") or "TWSE").strip()
+                    stock_id = get_or_create_stock(session, code, name, market).id
+                stock_map[code] = stock_id
 
             stock_id = stock_map[code]
-
-            def safe_float(val):
-                if pd.isna(val):
-                    return None
-                try:
-                    return float(val)
-                except (ValueError, TypeError):
-                    return None
-
-            def safe_int(val):
-                if pd.isna(val):
-                    return None
-                try:
-                    return int(val)
-                except (ValueError, TypeError):
-                    return None
-
-            stmt = insert(StockPrice).values(
+            rows[(stock_id, trade_date)] = dict(
                 stock_id=stock_id,
                 trade_date=trade_date,
-                open_price=safe_float(row.get("open_price")),
-                high_price=safe_float(row.get("high_price")),
-                low_price=safe_float(row.get("low_price")),
-                close_price=safe_float(row.get("close_price")),
-                volume=safe_int(row.get("volume")),
-                turnover=safe_int(row.get("turnover")),
-                change_amount=safe_float(row.get("change_amount")),
-                change_percent=safe_float(row.get("change_percent")),
-                transactions=safe_int(row.get("transactions")),
-            ).on_conflict_do_update(
-                index_elements=["stock_id", "trade_date"],
-                set_=dict(
-                    open_price=safe_float(row.get("open_price")),
-                    high_price=safe_float(row.get("high_price")),
-                    low_price=safe_float(row.get("low_price")),
-                    close_price=safe_float(row.get("close_price")),
-                    volume=safe_int(row.get("volume")),
-                    turnover=safe_int(row.get("turnover")),
-                    change_amount=safe_float(row.get("change_amount")),
-                    change_percent=safe_float(row.get("change_percent")),
-                    transactions=safe_int(row.get("transactions")),
-                )
+                **{col: row[col] for col in PRICE_UPDATE_COLS},
             )
-            session.execute(stmt)
-            count += 1
 
-    return count
+        trade_dates = sorted({key[1] for key in rows})
+        if not _prices_exist_for_dates(session, trade_dates):
+            _copy_rows(session, "stock_prices", ["stock_id", "trade_date", *PRICE_UPDATE_COLS], list(rows.values()))
+        else:
+            _copy_upsert(session, "stock_prices", list(rows.values()), PRICE_UPDATE_COLS)
+        _advance_watermark(session, "stock_prices", trade_dates)
+
+    _STOCK_ID_CACHE.update(stock_map)
+    return len(rows)
 
 
 def upsert_ratios(df: pd.DataFrame) -> int:
     """Upsert institutional ratios from DataFrame.
 
+    Rows that already carry a stock_id (as compute_ratios_from_db returns)
+    are keyed by it directly; otherwise the code is resolved to an id.
+
     Returns:
         Number of ratios upserted
     """
     if df.empty:
         return 0
 
-    count = 0
+    ratios = df.rename(columns={
+        f"three_inst_ratio_change_{w}": f"change_{w}d" for w in (5, 20, 60, 120)
+    })
+    records = _to_nullable_records(ratios, RATIO_FLOAT_COLS, RATIO_INT_COLS)
+
     with get_db_session() as session:
         stock_map: Dict[str, int] = {}
+        params: Dict[tuple, dict] = {}
 
-        for _, row in df.iterrows():
-            code = str(row["code"]).strip()
+        for row in records:
             trade_date = row["date"] if isinstance(row["date"], date) else pd.to_datetime(row["date"]).date()
 
+            stock_id = row.get("stock_id")
+            if stock_id is None:
+                code = str(row["code"]).strip()
+                if code not in stock_map:
+                    stock_id = _STOCK_ID_CACHE.get(code)
+                    if stock_id is None:
+                        stock = session.query(Stock).filter_by(code=code).first()
+                        if not stock:
+                            continue
+                        stock_id = stock.id
+                    stock_map[code] = stock_id
+                stock_id = stock_map[code]
+
+            params[(stock_id, trade_date)] = dict(
+                stock_id=stock_id,
+                trade_date=trade_date,
+                **{col: row[col] for col in RATIO_UPDATE_COLS},
+            )
+
+        if params:
+            _copy_upsert(session, "institutional_ratios", list(params.values()), RATIO_UPDATE_COLS)
+
+    _STOCK_ID_CACHE.update(stock_map)
+    return len(params)
+
+
+def sync_baselines(df: Optional[pd.DataFrame]) -> int:
+    """Replace institutional_baselines with the baseline calibration points.
+
+    The baseline CSV stays the source of truth; the table mirrors it so
+    compute_ratios_from_db can anchor holdings in SQL. Rows with an invalid
+    date or an unknown stock code are skipped, like build_estimated_holdings.
+
+    Expected columns: date, code, trust_shares_base, dealer_shares_base
+
+    Returns:
+        Number of baselines stored
+    """
+    with get_db_session() as session:
+        session.execute(text("DELETE FROM institutional_baselines"))
+        if df is None or df.empty or "date" not in df.columns:
+            return 0
+
+        base = df.assign(date=pd.to_datetime(df["date"], format="%Y-%m-%d", errors="coerce"))
+        base = base.dropna(subset=["date"])
+        records = _to_nullable_records(base, [], BASELINE_INT_COLS)
+
+        stock_map: Dict[str, int] = {}
+        params: Dict[tuple, dict] = {}
+        for row in records:
+            code = str(row["code"]).strip()
             if code not in stock_map:
-                stock = session.query(Stock).filter_by(code=code).first()
-                if not stock:
-                    continue
-                stock_map[code] = stock.id
+                stock_id = _STOCK_ID_CACHE.get(code)
+                if stock_id is None:
+                    stock = session.query(Stock).filter_by(code=code).first()
+                    if not stock:
+                        continue
+                    stock_id = stock.id
+                stock_map[code] = stock_id
 
             stock_id = stock_map[code]
-
-            def safe_float(val, default=None):
-                if pd.isna(val):
-                    return default
-                try:
-                    return float(val)
-                except (ValueError, TypeError):
-                    return default
-
-            def safe_int(val, default=None):
-                if pd.isna(val):
-                    return default
-                try:
-                    return int(val)
-                except (ValueError, TypeError):
-                    return default
-
-            stmt = insert(InstitutionalRatio).values(
+            baseline_date = row["date"].date()
+            params[(stock_id, baseline_date)] = dict(
                 stock_id=stock_id,
-                trade_date=trade_date,
-                foreign_ratio=safe_float(row.get("foreign_ratio")),
-                trust_ratio_est=safe_float(row.get("trust_ratio_est")),
-                dealer_ratio_est=safe_float(row.get("dealer_ratio_est")),
-                three_inst_ratio_est=safe_float(row.get("three_inst_ratio_est")),
-                trust_shares_est=safe_int(row.get("trust_shares_est")),
-                dealer_shares_est=safe_int(row.get("dealer_shares_est")),
-                change_5d=safe_float(row.get("three_inst_ratio_change_5")),
-                change_20d=safe_float(row.get("three_inst_ratio_change_20")),
-                change_60d=safe_float(row.get("three_inst_ratio_change_60")),
-                change_120d=safe_float(row.get("three_inst_ratio_change_120")),
-            ).on_conflict_do_update(
-                index_elements=["stock_id", "trade_date"],
-                set_=dict(
-                    foreign_ratio=safe_float(row.get("foreign_ratio")),
-                    trust_ratio_est=safe_float(row.get("trust_ratio_est")),
-                    dealer_ratio_est=safe_float(row.get("dealer_ratio_est")),
-                    three_inst_ratio_est=safe_float(row.get("three_inst_ratio_est")),
-                    trust_shares_est=safe_int(row.get("trust_shares_est")),
-                    dealer_shares_est=safe_int(row.get("dealer_shares_est")),
-                    change_5d=safe_float(row.get("three_inst_ratio_change_5")),
-                    change_20d=safe_float(row.get("three_inst_ratio_change_20")),
-                    change_60d=safe_float(row.get("three_inst_ratio_change_60")),
-                    change_120d=safe_float(row.get("three_inst_ratio_change_120")),
-                )
+                baseline_date=baseline_date,
+                **{col: row[col] for col in BASELINE_INT_COLS},
             )
-            session.execute(stmt)
-            count += 1
 
-    return count
+        if params:
+            session.execute(BASELINE_UPSERT, list(params.values()))
+
+    _STOCK_ID_CACHE.update(stock_map)
+    return len(params)
 
 
 def upsert_broker_trades(df: pd.DataFrame, trade_date: date) -> int:
@@ -323,39 +479,45 @@ def upsert_broker_trades(df: pd.DataFrame, trade_date: date) -> int:
     if df.empty:
         return 0
 
+    records = _to_nullable_records(df, ["pct"], BROKER_INT_COLS, fill_value=0)
+
     count = 0
-    with get_db_session() as session:
+    with get_db_session(expire_on_commit=False) as session:
         stock_map: Dict[str, int] = {}
 
-        for _, row in df.iterrows():
-            code = str(row.get("stock_code", "")).strip()
+        for row in records:
+            code = str(row.get("stock_code") or "").strip()
             if not code:
                 continue
 
             if code not in stock_map:
-                stock = session.query(Stock).filter_by(code=code).first()
-                if not stock:
-                    # Create stock if not exists
-                    stock = Stock(code=code, name=code, market="TWSE")
-                    session.add(stock)
-                    session.flush()
-                stock_map[code] = stock.id
+                stock_id = _STOCK_ID_CACHE.get(code)
+                if stock_id is None:
+                    stock = session.query(Stock).filter_by(code=code).first()
+                    if not stock:
+                        # Create stock if not exists
+                        stock = Stock(code=code, name=code, market="TWSE")
+                        session.add(stock)
+                        session.flush()
+                    stock_id = stock.id
+                stock_map[code] = stock_id
 
             stock_id = stock_map[code]
 
             broker_trade = BrokerTrade(
                 stock_id=stock_id,
                 trade_date=trade_date,
-                broker_name=str(row.get("broker_name", "")).strip(),
-                broker_id=str(row.get("broker_id", "")).strip() or None,
-                buy_vol=int(row.get("buy_vol", 0) or 0),
-                sell_vol=int(row.get("sell_vol", 0) or 0),
-                net_vol=int(row.get("net_vol", 0) or 0),
-                pct=float(row.get("pct", 0) or 0),
-                rank=int(row.get("rank", 0) or 0),
-                side=str(row.get("side", "")).strip() or None,
+                broker_name=str(row.get("broker_name") or "").strip(),
+                broker_id=str(row.get("broker_id") or "").strip() or None,
+                buy_vol=row["buy_vol"],
+                sell_vol=row["sell_vol"],
+                net_vol=row["net_vol"],
+                pct=row["pct"],
+                rank=row["rank"],
+                side=str(row.get("side") or "").strip() or None,
             )
             session.add(broker_trade)
             count += 1
 
+    _STOCK_ID_CACHE.update(stock_map)
     return count
@@ -1,60 +1,343 @@
-"""Compute and store pre-calculated strategy rankings."""
+"""Compute and store pre-calculated strategy rankings.
+
+Each compute_* function clears and commits its own metric, so the API reads
+either the old or the new rows of a metric, never an empty one. With
+batched=True it skips both and leaves them to the caller (see
+run_all_computations with max_workers=1).
+
+Inputs shared by several rankings (the latest price and tier of each stock,
+the recent institutional flows window, the win-rate buy signals) are
+materialized once per run by refresh_strategy_views; the compute_* functions
+only read those views, so call it first when running one of them on its own.
+All DDL lives in ensure_strategy_schema, which only the ETL entry points call.
+"""
+import io
 import logging
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from datetime import date, timedelta
+from typing import Callable, Dict, List, Optional
+
+import numpy as np
+import pandas as pd
 from sqlalchemy import text
+from sqlalchemy.exc import ProgrammingError
+
+from src.common.database import SessionLocal
 
 logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s")
 logger = logging.getLogger(__name__)
 
+# 勝率排行的持有天數
+WIN_RATE_HOLDING_DAYS = (5, 10, 30)
 
-def compute_win_rate_rankings(db, holding_days: int = 10, min_signals: int = 2):
-    """Compute and store win rate rankings for a specific holding period."""
-    metric_type = f"win_rate_{holding_days}d"
-    logger.info(f"Computing {metric_type}...")
+# 短期策略共用的法人買賣超視窗天數 (lookback_days 不可超過此值)
+FLOWS_WINDOW_DAYS = 60
 
-    # Clear old data for this metric
-    db.execute(text("DELETE FROM strategy_rankings WHERE metric_type = :metric_type"),
-               {"metric_type": metric_type})
+# latest_stock_prices.price_tier 的所有可能值
+PRICE_TIERS = ("high", "mid", "low")
 
-    # Compute and insert new rankings
-    query = text("""
-    WITH latest_prices AS (
-        SELECT DISTINCT ON (stock_id)
-            stock_id,
-            close_price,
-            trade_date
-        FROM stock_prices
-        ORDER BY stock_id, trade_date DESC
+# 各策略共用的最新收盤價，每次計算前以 REFRESH 更新一次
+# 以 LATERAL 逐檔讀取 (stock_id, trade_date DESC) index 的第一筆，避免對整個價格歷史排序
+# price_tier 依最新收盤價分級，只在 refresh 時計算一次
+LATEST_PRICES_VIEW_SQL = """
+CREATE MATERIALIZED VIEW IF NOT EXISTS latest_stock_prices AS
+SELECT
+    s.id as stock_id,
+    lp.close_price,
+    lp.trade_date,
+    CASE
+        WHEN lp.close_price >= 500 THEN 'high'
+        WHEN lp.close_price >= 200 THEN 'mid'
+        ELSE 'low'
+    END as price_tier
+FROM stocks s
+CROSS JOIN LATERAL (
+    SELECT close_price, trade_date
+    FROM stock_prices
+    WHERE stock_id = s.id
+    ORDER BY trade_date DESC
+    LIMIT 1
+) lp
+"""
+
+# 近 60 日三大法人買賣超與當日收盤價，供短期策略共用
+RECENT_FLOWS_VIEW_SQL = f"""
+CREATE MATERIALIZED VIEW IF NOT EXISTS recent_institutional_flows AS
+SELECT
+    f.stock_id,
+    f.trade_date,
+    f.foreign_net,
+    f.trust_net,
+    f.dealer_net,
+    f.foreign_net + f.trust_net + f.dealer_net as total_net,
+    p.close_price
+FROM institutional_flows f
+LEFT JOIN stock_prices p ON f.stock_id = p.stock_id AND f.trade_date = p.trade_date
+WHERE f.trade_date >= CURRENT_DATE - {FLOWS_WINDOW_DAYS}
+"""
+
+# 勝率排行的進場訊號 (近 5 日外資買超 >= 3 天) 與進場價，與持有天數無關，
+# 每次計算前 refresh 一次，供三個持有天數共用
+WIN_RATE_SIGNALS_VIEW_SQL = """
+CREATE MATERIALIZED VIEW IF NOT EXISTS win_rate_buy_signals AS
+WITH consecutive_buying AS (
+    SELECT
+        f.stock_id,
+        f.trade_date,
+        COUNT(*) FILTER (WHERE f.foreign_net > 0)
+            OVER (PARTITION BY f.stock_id ORDER BY f.trade_date
+                  ROWS BETWEEN 4 PRECEDING AND CURRENT ROW) as buy_streak_5
+    FROM institutional_flows f
+    WHERE f.trade_date >= '2024-01-01'
+)
+SELECT
+    cb.stock_id,
+    cb.trade_date as signal_date,
+    p.close_price as entry_price
+FROM consecutive_buying cb
+JOIN stock_prices p ON cb.stock_id = p.stock_id AND p.trade_date = cb.trade_date
+WHERE cb.buy_streak_5 >= 3 AND p.close_price > 0
+"""
+
+# 外資買賣超與日報酬相關係數的累加統計量，由 update_correlation_sufstats 增量更新
+CORRELATION_SUFSTATS_TABLE_SQL = """
+CREATE TABLE IF NOT EXISTS correlation_sufstats (
+    stock_id INTEGER PRIMARY KEY REFERENCES stocks(id) ON DELETE CASCADE,
+    n BIGINT NOT NULL,
+    sum_fn NUMERIC NOT NULL,
+    sum_r NUMERIC NOT NULL,
+    sum_fn_r NUMERIC NOT NULL,
+    sum_fn2 NUMERIC NOT NULL,
+    sum_r2 NUMERIC NOT NULL,
+    last_date DATE NOT NULL,
+    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+)
+"""
+
+# 每次計算都會執行的短語句，建立一次供各函式重用
+DELETE_METRIC_STMT = text("DELETE FROM strategy_rankings WHERE metric_type = :metric_type")
+DELETE_METRICS_STMT = text("DELETE FROM strategy_rankings WHERE metric_type = ANY(:metric_types)")
+CURRENT_DATE_STMT = text("SELECT CURRENT_DATE")
+INDEX_VALID_STMT = text("SELECT indisvalid FROM pg_index WHERE indexrelid = to_regclass(:name)")
+EXECUTE_WIN_RATE_STMT = text("EXECUTE win_rate_rankings(:holding_days, :min_signals, :metric_type)")
+# correlation_sufstats 的讀取與累加必須序列化：重疊的兩次計算會讀到同一個 last_date，
+# 同一批差額會被加兩次；交易結束時自動釋放
+LOCK_CORRELATION_SUFSTATS_STMT = text("SELECT pg_advisory_xact_lock(hashtext('correlation_sufstats'))")
+
+# 策略查詢依賴的基礎表 covering index：index name -> 建立後執行的語句
+# (既有部署不會重跑 init.sql；CONCURRENTLY 建立不阻擋 ETL 寫入)
+STRATEGY_TABLE_INDEXES = {
+    # 出場價 lookup 與技術指標都只讀收盤/高/低價，可走 index-only scan
+    "idx_prices_stock_date_covering": [
+        "CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_prices_stock_date_covering "
+        "ON stock_prices(stock_id, trade_date DESC) INCLUDE (close_price, high_price, low_price)",
+        # 被 covering index 取代
+        "DROP INDEX CONCURRENTLY IF EXISTS idx_prices_stock_date",
+        "ANALYZE stock_prices",
+    ],
+    # recent_institutional_flows 依日期範圍讀取買賣超，可走 index-only scan；
+    # 逐檔查詢由 UNIQUE(stock_id, trade_date) 負責，不再另建一個同鍵的寬 index
+    "idx_flows_date_stock": [
+        "CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_flows_date_stock "
+        "ON institutional_flows(trade_date, stock_id) INCLUDE (foreign_net, trust_net, dealer_net)",
+        # 被 idx_flows_date_stock 取代
+        "DROP INDEX CONCURRENTLY IF EXISTS idx_flows_date",
+        "ANALYZE institutional_flows",
+    ],
+}
+
+# view name -> (CREATE statement, its indexes, columns the queries expect;
+#               a view missing any of the columns is rebuilt)
+STRATEGY_VIEWS = {
+    "latest_stock_prices": (
+        LATEST_PRICES_VIEW_SQL,
+        [
+            # REFRESH ... CONCURRENTLY 需要 unique index
+            "CREATE UNIQUE INDEX IF NOT EXISTS idx_latest_stock_prices ON latest_stock_prices(stock_id)",
+        ],
+        {"stock_id", "close_price", "trade_date", "price_tier"},
     ),
-    consecutive_buying AS (
-        SELECT
-            f.stock_id,
-            f.trade_date,
-            f.foreign_net,
-            SUM(CASE WHEN f.foreign_net > 0 THEN 1 ELSE 0 END)
-                OVER (PARTITION BY f.stock_id ORDER BY f.trade_date
-                      ROWS BETWEEN 4 PRECEDING AND CURRENT ROW) as buy_streak_5
-        FROM institutional_flows f
-        WHERE f.trade_date >= '2024-01-01'
+    "recent_institutional_flows": (
+        RECENT_FLOWS_VIEW_SQL,
+        [
+            "CREATE UNIQUE INDEX IF NOT EXISTS idx_recent_institutional_flows "
+            "ON recent_institutional_flows(stock_id, trade_date)",
+            # 三大法人同步買超的日子很少，partial index 直接回答 synchronized_buying
+            "CREATE INDEX IF NOT EXISTS idx_recent_flows_sync_positive "
+            "ON recent_institutional_flows(trade_date, stock_id) "
+            "INCLUDE (foreign_net, trust_net, dealer_net, total_net) "
+            "WHERE foreign_net > 0 AND trust_net > 0 AND dealer_net > 0",
+        ],
+        {"stock_id", "trade_date", "foreign_net", "trust_net", "dealer_net", "total_net", "close_price"},
     ),
-    buy_signals AS (
-        SELECT stock_id, trade_date as signal_date
-        FROM consecutive_buying
-        WHERE buy_streak_5 >= 3
+    "win_rate_buy_signals": (
+        WIN_RATE_SIGNALS_VIEW_SQL,
+        [
+            "CREATE UNIQUE INDEX IF NOT EXISTS idx_win_rate_buy_signals "
+            "ON win_rate_buy_signals(stock_id, signal_date)",
+        ],
+        {"stock_id", "signal_date", "entry_price"},
     ),
-    returns AS (
+}
+
+
+def ensure_strategy_schema(engine):
+    """
+    Create or repair every object the strategy computations rely on.
+
+    Covers the base-table indexes, correlation_sufstats and the materialized
+    views with their indexes. This is the only place the strategy DDL runs;
+    it is called from the ETL entry points, never from run_all_computations,
+    which the API recompute route also calls.
+    """
+    _ensure_table_indexes(engine)
+    with engine.begin() as conn:
+        conn.execute(text(CORRELATION_SUFSTATS_TABLE_SQL))
+        _ensure_strategy_views(conn)
+
+
+def _ensure_table_indexes(engine):
+    """
+    Create any missing or invalid base-table index the strategy queries rely on.
+
+    A CREATE INDEX CONCURRENTLY that failed or was cancelled leaves an
+    INVALID index behind, which is dropped and rebuilt. Runs on its own
+    autocommit connection, since CREATE INDEX CONCURRENTLY cannot run inside
+    a transaction and would wait on the caller's open one.
+    """
+    with engine.connect().execution_options(isolation_level="AUTOCOMMIT") as conn:
+        for name, statements in STRATEGY_TABLE_INDEXES.items():
+            # NULL = 不存在，FALSE = 建立中斷留下的 INVALID index
+            valid = conn.execute(INDEX_VALID_STMT, {"name": name}).scalar()
+            if valid:
+                continue
+            if valid is not None:
+                logger.warning(f"Index {name} is invalid, rebuilding")
+                conn.execute(text(f"DROP INDEX CONCURRENTLY IF EXISTS {name}"))
+            for statement in statements:
+                conn.execute(text(statement))
+            logger.info(f"Created index {name}")
+
+
+def _ensure_strategy_views(conn):
+    """Create missing views, rebuild views whose columns changed, and add their indexes."""
+    # 一次查出所有 view 目前的欄位
+    existing: Dict[str, set] = {name: set() for name in STRATEGY_VIEWS}
+    for name, column in conn.execute(text("""
+        SELECT c.relname, a.attname
+        FROM pg_class c
+        JOIN pg_attribute a ON a.attrelid = c.oid AND a.attnum > 0 AND NOT a.attisdropped
+        WHERE c.oid = ANY(ARRAY(SELECT to_regclass(v) FROM unnest(CAST(:names AS text[])) v))
+    """), {"names": list(STRATEGY_VIEWS)}):
+        existing[name].add(column)
+
+    for name, (create_sql, index_sqls, columns) in STRATEGY_VIEWS.items():
+        statements = []
+        if not columns <= existing[name]:
+            # 首次執行或欄位定義已變更：重建 view
+            statements += [f"DROP MATERIALIZED VIEW IF EXISTS {name}", create_sql]
+        statements += index_sqls
+        # 沒有 bind 參數，整串 DDL 以單次 round trip 送出
+        conn.execute(text(";\n".join(statements)))
+
+
+def refresh_strategy_views(db):
+    """
+    Refresh the materialized views the rankings read from.
+
+    Only these refreshes scan stock_prices / institutional_flows for the
+    short-window strategies; every compute_* function reads the small views
+    instead of rebuilding latest_prices and its own flows window. The views
+    themselves are created by ensure_strategy_schema.
+    """
+    statements = []
+    for name in STRATEGY_VIEWS:
+        # CONCURRENTLY 不會阻擋 API 讀取；
+        # view 不會被 autovacuum 及時 analyze，refresh 後手動更新統計資訊
+        statements += [f"REFRESH MATERIALIZED VIEW CONCURRENTLY {name}", f"ANALYZE {name}"]
+    db.execute(text(";\n".join(statements)))
+    db.commit()
+    logger.info(f"Refreshed {', '.join(STRATEGY_VIEWS)}")
+
+
+def _top_per_tier(source: str, order_by: str, limit: int) -> str:
+    """
+    Build a `ranked` CTE with the top `limit` rows of `source` per price tier.
+
+    Each tier is its own ORDER BY ... LIMIT branch joined with UNION ALL, so
+    the planner runs three bounded top-N sorts over `source`, which is
+    materialized once since it is referenced per tier; rank is numbered
+    afterwards on at most 3 * limit rows.
+    """
+    branches = "\n        UNION ALL\n        ".join(
+        f"(SELECT * FROM {source} WHERE price_tier = '{tier}' ORDER BY {order_by} LIMIT {limit})"
+        for tier in PRICE_TIERS
+    )
+    return f"""ranked AS (
+        SELECT
+            t.*,
+            ROW_NUMBER() OVER (PARTITION BY t.price_tier ORDER BY {order_by}) as rank
+        FROM (
+        {branches}
+        ) t
+    )"""
+
+
+def _cutoff(db, days: int) -> date:
+    """
+    Window start as a literal date, so the planner sees a constant bound.
+
+    Counted from the database's CURRENT_DATE, like the views' own windows,
+    rather than the container's clock and timezone.
+    """
+    return db.execute(CURRENT_DATE_STMT).scalar() - timedelta(days=days)
+
+
+# PostgreSQL SQLSTATE duplicate_prepared_statement
+DUPLICATE_PREPARED_STATEMENT = "42P05"
+
+
+def _ensure_prepared(db, name: str, arg_types: str, statement: str):
+    """
+    PREPARE `statement` once per pooled connection.
+
+    Prepared statements live as long as the DBAPI connection, so the names
+    already prepared are remembered in its info dict and later runs go
+    straight to EXECUTE without an extra round trip. The first PREPARE runs
+    in a savepoint and tolerates the name already existing on the server.
+    """
+    prepared = db.connection().info.setdefault("prepared_statements", set())
+    if name in prepared:
+        return
+    try:
+        with db.begin_nested():
+            db.execute(text(f"PREPARE {name} {arg_types} AS {statement}"))
+    except ProgrammingError as e:
+        if getattr(e.orig, "pgcode", None) != DUPLICATE_PREPARED_STATEMENT:
+            raise
+    prepared.add(name)
+
+
+# $1 = holding_days, $2 = min_signals, $3 = metric_type
+WIN_RATE_STATEMENT = f"""
+    WITH returns AS (
         SELECT
             bs.stock_id,
             bs.signal_date,
-            p1.close_price as entry_price,
+            bs.entry_price,
             p2.close_price as exit_price,
-            ROUND((p2.close_price - p1.close_price) / NULLIF(p1.close_price, 0) * 100, 2) as return_pct
-        FROM buy_signals bs
-        JOIN stock_prices p1 ON bs.stock_id = p1.stock_id AND p1.trade_date = bs.signal_date
-        JOIN stock_prices p2 ON bs.stock_id = p2.stock_id AND p2.trade_date = (
-            SELECT MIN(trade_date) FROM stock_prices
-            WHERE stock_id = bs.stock_id AND trade_date > bs.signal_date + :holding_days - 1
-        )
-        WHERE p1.close_price > 0 AND p2.close_price IS NOT NULL
+            ROUND((p2.close_price - bs.entry_price) / bs.entry_price * 100, 2) as return_pct
+        FROM win_rate_buy_signals bs
+        -- 持有 N 天後的第一個交易日收盤價；idx_prices_stock_date_covering 含 close_price，
+        -- 每筆訊號只做一次 index-only 範圍掃描的第一筆
+        CROSS JOIN LATERAL (
+            SELECT close_price
+            FROM stock_prices
+            WHERE stock_id = bs.stock_id AND trade_date >= bs.signal_date + $1
+            ORDER BY trade_date
+            LIMIT 1
+        ) p2
+        WHERE p2.close_price IS NOT NULL
     ),
     stock_stats AS (
         SELECT
@@ -62,269 +345,438 @@ def compute_win_rate_rankings(db, holding_days: int = 10, min_signals: int = 2):
             lp.close_price as current_price,
             COUNT(*) as signal_count,
             ROUND(AVG(r.return_pct), 2) as avg_return,
-            ROUND(SUM(CASE WHEN r.return_pct > 0 THEN 1 ELSE 0 END) * 100.0 / NULLIF(COUNT(*), 0), 1) as win_rate,
-            CASE
-                WHEN lp.close_price >= 500 THEN 'high'
-                WHEN lp.close_price >= 200 THEN 'mid'
-                ELSE 'low'
-            END as price_tier
+            ROUND(COUNT(*) FILTER (WHERE r.return_pct > 0) * 100.0 / NULLIF(COUNT(*), 0), 1) as win_rate,
+            lp.price_tier
         FROM returns r
-        LEFT JOIN latest_prices lp ON r.stock_id = lp.stock_id
-        GROUP BY r.stock_id, lp.close_price
-        HAVING COUNT(*) >= :min_signals
+        LEFT JOIN latest_stock_prices lp ON r.stock_id = lp.stock_id
+        GROUP BY r.stock_id, lp.close_price, lp.price_tier
+        HAVING COUNT(*) >= $2
     ),
-    ranked AS (
-        SELECT
-            *,
-            ROW_NUMBER() OVER (PARTITION BY price_tier ORDER BY win_rate DESC, avg_return DESC) as rank
-        FROM stock_stats
-    )
+    {_top_per_tier("stock_stats", "win_rate DESC, avg_return DESC", 10)}
     INSERT INTO strategy_rankings (stock_id, price_tier, metric_type, signal_count, avg_return, win_rate, current_price, rank_in_tier)
-    SELECT stock_id, price_tier, :metric_type, signal_count, avg_return, win_rate, current_price, rank
+    SELECT stock_id, price_tier, $3, signal_count, avg_return, win_rate, current_price, rank
     FROM ranked
-    WHERE rank <= 10
-    """)
+"""
 
-    result = db.execute(query, {
-        "holding_days": holding_days,
-        "min_signals": min_signals,
-        "metric_type": metric_type
-    })
-    db.commit()
+
+def compute_win_rate_rankings(db, holding_days: int = 10, min_signals: int = 2, batched: bool = False):
+    """Compute and store win rate rankings for a specific holding period."""
+    metric_type = f"win_rate_{holding_days}d"
+    logger.info(f"Computing {metric_type}...")
+
+    # Clear old data for this metric
+    if not batched:
+        db.execute(DELETE_METRIC_STMT, {"metric_type": metric_type})
+
+    # Compute and insert new rankings (plan prepared once per connection)
+    _ensure_prepared(db, "win_rate_rankings", "(int, int, text)", WIN_RATE_STATEMENT)
+    result = db.execute(
+        EXECUTE_WIN_RATE_STMT,
+        {"holding_days": holding_days, "min_signals": min_signals, "metric_type": metric_type},
+    )
+    if not batched:
+        db.commit()
     logger.info(f"  Inserted {result.rowcount} rankings for {metric_type}")
     return result.rowcount
 
 
-def compute_correlation_rankings(db, min_data_points: int = 5):
-    """Compute and store correlation rankings."""
-    metric_type = "correlation"
-    logger.info(f"Computing {metric_type}...")
+def invalidate_correlation_sufstats(
+    db, since: Optional[date] = None, changed: Optional[Dict[int, date]] = None
+) -> int:
+    """
+    Drop running sums that may already include days about to be rewritten.
 
-    db.execute(text("DELETE FROM strategy_rankings WHERE metric_type = :metric_type"),
-               {"metric_type": metric_type})
+    The incremental update never revisits days at or before a stock's
+    last_date, so callers that backfill or correct prices or flows call this
+    afterwards; the next update rebuilds the dropped stocks from their full
+    history. Pass `changed` (stock_id -> earliest rewritten trade_date) to
+    drop only the stocks whose sums cover one of their rewritten days, or
+    `since` to drop every stock with last_date >= since (None: all stocks).
+    """
+    if changed is not None and not changed:
+        return 0
+    if db.execute(text("SELECT to_regclass('correlation_sufstats')")).scalar() is None:
+        # 尚未建立 (ETL 從未執行過)，沒有可作廢的累加值
+        return 0
+    db.execute(LOCK_CORRELATION_SUFSTATS_STMT)
+    if changed is not None:
+        result = db.execute(text("""
+            DELETE FROM correlation_sufstats cs
+            USING unnest(CAST(:stock_ids AS integer[]), CAST(:dates AS date[])) AS c(stock_id, since)
+            WHERE cs.stock_id = c.stock_id AND cs.last_date >= c.since
+        """), {"stock_ids": list(changed), "dates": list(changed.values())})
+    else:
+        result = db.execute(
+            text("DELETE FROM correlation_sufstats WHERE CAST(:since AS date) IS NULL OR last_date >= :since"),
+            {"since": since},
+        )
+    logger.info(f"Invalidated correlation statistics for {result.rowcount} stocks")
+    return result.rowcount
+
+
+def update_correlation_sufstats(db):
+    """
+    Fold new (foreign_net, daily_return) pairs into correlation_sufstats.
+
+    Pearson correlation only needs n, Σx, Σy, Σxy, Σx², Σy², so each stock
+    keeps those running sums plus the last trade_date already folded in, and
+    a run only reads rows after it. The row at last_date is re-read to seed
+    LAG(close_price). History written at or before last_date is only picked
+    up after invalidate_correlation_sufstats().
+
+    Holds an advisory lock until the caller's transaction ends, so concurrent
+    runs (API recompute and the ETL) fold each day in exactly once.
+    """
+    db.execute(LOCK_CORRELATION_SUFSTATS_STMT)
 
     query = text("""
-    WITH latest_prices AS (
-        SELECT DISTINCT ON (stock_id)
-            stock_id,
-            close_price
-        FROM stock_prices
-        ORDER BY stock_id, trade_date DESC
-    ),
-    daily_data AS (
+    WITH daily_data AS (
         SELECT
-            f.stock_id,
-            f.trade_date,
-            f.foreign_net,
-            p.close_price,
-            LAG(p.close_price) OVER (PARTITION BY f.stock_id ORDER BY f.trade_date) as prev_close
-        FROM institutional_flows f
-        JOIN stock_prices p ON f.stock_id = p.stock_id AND f.trade_date = p.trade_date
-        WHERE f.trade_date >= '2024-01-01'
+            s.id as stock_id,
+            d.trade_date,
+            d.foreign_net,
+            d.close_price,
+            d.prev_close,
+            cs.last_date
+        FROM stocks s
+        LEFT JOIN correlation_sufstats cs ON cs.stock_id = s.id
+        -- 每檔以自己的 last_date 為下界，沿 (stock_id, trade_date) index 只做範圍掃描，
+        -- 不必讀整個 flows ⋈ prices 歷史再過濾
+        CROSS JOIN LATERAL (
+            SELECT
+                f.trade_date,
+                f.foreign_net::numeric as foreign_net,
+                p.close_price,
+                LAG(p.close_price) OVER (ORDER BY f.trade_date) as prev_close
+            FROM institutional_flows f
+            JOIN stock_prices p ON f.stock_id = p.stock_id AND f.trade_date = p.trade_date
+            WHERE f.stock_id = s.id
+              AND f.trade_date >= COALESCE(cs.last_date, DATE '2024-01-01')
+        ) d
     ),
     returns_data AS (
         SELECT
             stock_id,
             trade_date,
             foreign_net,
-            CASE WHEN prev_close > 0
-                THEN (close_price - prev_close) / prev_close * 100
-                ELSE 0
-            END as daily_return
+            (close_price - prev_close) / NULLIF(prev_close, 0) * 100 as daily_return,
+            prev_close > 0 as has_return
         FROM daily_data
-        WHERE prev_close IS NOT NULL AND prev_close > 0
-    ),
-    correlations AS (
+        WHERE last_date IS NULL OR trade_date > last_date
+    )
+    INSERT INTO correlation_sufstats (
+        stock_id, n, sum_fn, sum_r, sum_fn_r, sum_fn2, sum_r2, last_date
+    )
+    SELECT
+        stock_id,
+        COUNT(*) FILTER (WHERE has_return),
+        COALESCE(SUM(foreign_net) FILTER (WHERE has_return), 0),
+        COALESCE(SUM(daily_return) FILTER (WHERE has_return), 0),
+        COALESCE(SUM(foreign_net * daily_return) FILTER (WHERE has_return), 0),
+        COALESCE(SUM(foreign_net * foreign_net) FILTER (WHERE has_return), 0),
+        COALESCE(SUM(daily_return * daily_return) FILTER (WHERE has_return), 0),
+        MAX(trade_date)
+    FROM returns_data
+    GROUP BY stock_id
+    ON CONFLICT (stock_id) DO UPDATE SET
+        n = correlation_sufstats.n + EXCLUDED.n,
+        sum_fn = correlation_sufstats.sum_fn + EXCLUDED.sum_fn,
+        sum_r = correlation_sufstats.sum_r + EXCLUDED.sum_r,
+        sum_fn_r = correlation_sufstats.sum_fn_r + EXCLUDED.sum_fn_r,
+        sum_fn2 = correlation_sufstats.sum_fn2 + EXCLUDED.sum_fn2,
+        sum_r2 = correlation_sufstats.sum_r2 + EXCLUDED.sum_r2,
+        last_date = EXCLUDED.last_date,
+        updated_at = CURRENT_TIMESTAMP
+    """)
+
+    result = db.execute(query)
+    logger.info(f"  Updated correlation statistics for {result.rowcount} stocks")
+    return result.rowcount
+
+
+def compute_correlation_rankings(db, min_data_points: int = 5, batched: bool = False):
+    """
+    Compute and store correlation rankings.
+
+    Reads the exact running sums in correlation_sufstats, which are already a
+    fixed size per stock regardless of history length, so ranking costs one
+    row per stock without resorting to approximate sketches. The built-in
+    corr() aggregate would have to rescan every stock's full history each
+    run; since the sums are exact NUMERIC, the closed-form Pearson formula
+    below does not lose precision to cancellation either.
+    """
+    metric_type = "correlation"
+    logger.info(f"Computing {metric_type}...")
+
+    update_correlation_sufstats(db)
+
+    if not batched:
+        db.execute(DELETE_METRIC_STMT, {"metric_type": metric_type})
+
+    query = text(f"""
+    WITH correlations AS (
         SELECT
-            rd.stock_id,
-            lp.close_price as current_price,
-            COUNT(*) as data_points,
-            ROUND((
-                COUNT(*) * SUM(rd.foreign_net * rd.daily_return) - SUM(rd.foreign_net) * SUM(rd.daily_return)
-            ) / NULLIF(
-                SQRT(
-                    (COUNT(*) * SUM(rd.foreign_net * rd.foreign_net) - SUM(rd.foreign_net) * SUM(rd.foreign_net)) *
-                    (COUNT(*) * SUM(rd.daily_return * rd.daily_return) - SUM(rd.daily_return) * SUM(rd.daily_return))
-                ), 0
-            ), 4) as correlation,
-            CASE
-                WHEN lp.close_price >= 500 THEN 'high'
-                WHEN lp.close_price >= 200 THEN 'mid'
-                ELSE 'low'
-            END as price_tier
-        FROM returns_data rd
-        LEFT JOIN latest_prices lp ON rd.stock_id = lp.stock_id
-        GROUP BY rd.stock_id, lp.close_price
-        HAVING COUNT(*) >= :min_data_points
+            stock_id,
+            current_price,
+            data_points,
+            ROUND(covariance / SQRT(variance_product), 4) as correlation,
+            price_tier
+        FROM (
+            SELECT
+                cs.stock_id,
+                lp.close_price as current_price,
+                cs.n as data_points,
+                cs.n * cs.sum_fn_r - cs.sum_fn * cs.sum_r as covariance,
+                (cs.n * cs.sum_fn2 - cs.sum_fn * cs.sum_fn) *
+                (cs.n * cs.sum_r2 - cs.sum_r * cs.sum_r) as variance_product,
+                lp.price_tier
+            FROM correlation_sufstats cs
+            JOIN latest_stock_prices lp ON cs.stock_id = lp.stock_id
+            WHERE cs.n >= :min_data_points
+        ) m
+        -- 變異數為 0 的股票相關係數無定義，在排名前先排除
+        WHERE variance_product > 0
     ),
-    ranked AS (
-        SELECT
-            *,
-            ROW_NUMBER() OVER (PARTITION BY price_tier ORDER BY correlation DESC NULLS LAST) as rank
-        FROM correlations
-        WHERE correlation IS NOT NULL
-    )
+    {_top_per_tier("correlations", "correlation DESC", 10)}
     INSERT INTO strategy_rankings (stock_id, price_tier, metric_type, correlation, data_points, current_price, rank_in_tier)
     SELECT stock_id, price_tier, :metric_type, correlation, data_points, current_price, rank
     FROM ranked
-    WHERE rank <= 10
     """)
 
     result = db.execute(query, {"min_data_points": min_data_points, "metric_type": metric_type})
-    db.commit()
+    if not batched:
+        db.commit()
     logger.info(f"  Inserted {result.rowcount} rankings for {metric_type}")
     return result.rowcount
 
 
-def compute_below_cost_rankings(db, lookback_days: int = 60):
+def _copy_to_frame(db, query: str, dtypes: Dict[str, type]) -> pd.DataFrame:
+    """Stream a SELECT out with COPY ... TO STDOUT (csv) into a typed DataFrame."""
+    buf = io.StringIO()
+    raw = db.connection().connection
+    with raw.cursor() as cur:
+        cur.copy_expert(f"COPY ({query}) TO STDOUT WITH (FORMAT csv)", buf)
+    buf.seek(0)
+    return pd.read_csv(buf, header=None, names=list(dtypes), dtype=dtypes)
+
+
+def compute_cost_metrics(db, lookback_days: int = 60) -> pd.DataFrame:
+    """
+    Institutional weighted-average cost per stock, computed in NumPy.
+
+    Average cost = Σ(net_buy * close_price) / Σ(net_buy) over days where the
+    three institutions' combined net > 0. The positive-net rows of the window
+    are pulled with one COPY, ordered by stock, and summed per stock with
+    np.add.reduceat.
+
+    Returns:
+        DataFrame with stock_id, avg_cost, buy_days, total_shares,
+        current_price and price_tier (stocks without a latest price dropped)
+    """
+    flows = _copy_to_frame(db, f"""
+        SELECT stock_id, total_net, close_price
+        FROM recent_institutional_flows
+        WHERE trade_date >= DATE '{_cutoff(db, lookback_days).isoformat()}'
+          AND close_price > 0
+          AND total_net > 0
+        ORDER BY stock_id
+    """, {"stock_id": np.int64, "total_net": np.float64, "close_price": np.float64})
+    if flows.empty:
+        return pd.DataFrame(columns=[
+            "stock_id", "avg_cost", "buy_days", "total_shares", "current_price", "price_tier",
+        ])
+
+    stock_ids = flows["stock_id"].to_numpy()
+    net = flows["total_net"].to_numpy()
+    price = flows["close_price"].to_numpy()
+
+    # 每檔第一筆的位置，reduceat 以此切段加總
+    starts = np.flatnonzero(np.r_[True, stock_ids[1:] != stock_ids[:-1]])
+    total_shares = np.add.reduceat(net, starts)
+    weighted_cost = np.add.reduceat(net * price, starts)
+
+    costs = pd.DataFrame({
+        "stock_id": stock_ids[starts],
+        "avg_cost": weighted_cost / total_shares,
+        "buy_days": np.diff(np.r_[starts, len(stock_ids)]),
+        "total_shares": total_shares,
+    })
+
+    latest = pd.DataFrame(
+        db.execute(text("SELECT stock_id, close_price, price_tier FROM latest_stock_prices")).fetchall(),
+        columns=["stock_id", "current_price", "price_tier"],
+    )
+    latest["current_price"] = latest["current_price"].astype(np.float64)
+    return costs.merge(latest, on="stock_id", how="inner")
+
+
+def _round2(values):
+    """
+    Round to 2 decimals half away from zero, like SQL ROUND(numeric, 2).
+
+    NumPy rounds float64 half to even, so ties such as 1.005 are nudged 1e-9
+    away from zero first. The inputs are float64 rather than numeric, so a
+    value within 1e-9 of a tie can still differ from the old SQL output in
+    the last digit; the results are not guaranteed bit-identical.
+    """
+    return np.round(values + np.sign(values) * 1e-9, 2)
+
+
+def _rank_per_tier(df: pd.DataFrame, sort_by: str, ascending: bool, limit: int) -> pd.DataFrame:
+    """Keep the top `limit` rows per price tier and number them as rank_in_tier."""
+    ranked = (
+        df.sort_values(sort_by, ascending=ascending, kind="mergesort")
+        .groupby("price_tier", sort=False)
+        .head(limit)
+    )
+    return ranked.assign(rank_in_tier=ranked.groupby("price_tier", sort=False).cumcount() + 1)
+
+
+def _copy_from_frame(db, table: str, df: pd.DataFrame, columns: List[str]) -> None:
+    """Stream DataFrame rows into `table` with COPY ... FROM STDIN (csv, NULL as empty)."""
+    buf = io.StringIO()
+    df.to_csv(buf, header=False, index=False, na_rep="")
+    buf.seek(0)
+    raw = db.connection().connection
+    with raw.cursor() as cur:
+        cur.copy_expert(
+            f"COPY {table} ({', '.join(columns)}) FROM STDIN WITH (FORMAT csv, NULL '')",
+            buf,
+        )
+
+
+def _insert_rankings(db, metric_type: str, ranked: pd.DataFrame, columns: Dict[str, str]) -> int:
+    """
+    COPY DataFrame rankings into strategy_rankings.
+
+    Args:
+        columns: strategy_rankings column -> DataFrame column, besides the
+            stock_id / price_tier / current_price / rank_in_tier common to all
+    """
+    if ranked.empty:
+        return 0
+
+    target = ["metric_type", "stock_id", "price_tier", "current_price", "rank_in_tier", *columns]
+    source = ["stock_id", "price_tier", "current_price", "rank_in_tier", *columns.values()]
+    rows = ranked[source].copy()
+    rows.insert(0, "metric_type", metric_type)
+    _copy_from_frame(db, "strategy_rankings", rows, target)
+    return len(rows)
+
+
+def compute_below_cost_rankings(
+    db, lookback_days: int = 60, costs: Optional[pd.DataFrame] = None, batched: bool = False
+):
     """
     Compute stocks where current price is below institutional 3-month average cost.
 
     Average cost = Σ(net_buy * close_price) / Σ(net_buy) for days where net > 0
+
+    Args:
+        costs: compute_cost_metrics() output to reuse; computed here when omitted
     """
     metric_type = "below_cost"
     logger.info(f"Computing {metric_type}...")
 
-    db.execute(text("DELETE FROM strategy_rankings WHERE metric_type = :metric_type"),
-               {"metric_type": metric_type})
+    if not batched:
+        db.execute(DELETE_METRIC_STMT, {"metric_type": metric_type})
 
-    query = text("""
-    WITH latest_prices AS (
-        SELECT DISTINCT ON (stock_id)
-            stock_id,
-            close_price,
-            trade_date
-        FROM stock_prices
-        ORDER BY stock_id, trade_date DESC
-    ),
-    -- 計算三大法人合計淨買超
-    inst_flows AS (
-        SELECT
-            f.stock_id,
-            f.trade_date,
-            f.foreign_net + f.trust_net + f.dealer_net as total_net,
-            p.close_price
-        FROM institutional_flows f
-        JOIN stock_prices p ON f.stock_id = p.stock_id AND f.trade_date = p.trade_date
-        WHERE f.trade_date >= CURRENT_DATE - :lookback_days
-          AND p.close_price > 0
-    ),
-    -- 只計算淨買入日的加權平均成本
-    cost_calc AS (
-        SELECT
-            stock_id,
-            SUM(CASE WHEN total_net > 0 THEN total_net * close_price ELSE 0 END) as weighted_cost,
-            SUM(CASE WHEN total_net > 0 THEN total_net ELSE 0 END) as total_shares,
-            COUNT(CASE WHEN total_net > 0 THEN 1 END) as buy_days
-        FROM inst_flows
-        GROUP BY stock_id
-        HAVING SUM(CASE WHEN total_net > 0 THEN total_net ELSE 0 END) > 0
-    ),
-    -- 計算平均成本與現價差距
-    below_cost AS (
-        SELECT
-            c.stock_id,
-            lp.close_price as current_price,
-            ROUND(c.weighted_cost / c.total_shares, 2) as avg_cost,
-            c.buy_days,
-            c.total_shares,
-            ROUND((lp.close_price - c.weighted_cost / c.total_shares) / (c.weighted_cost / c.total_shares) * 100, 2) as discount_pct,
-            CASE
-                WHEN lp.close_price >= 500 THEN 'high'
-                WHEN lp.close_price >= 200 THEN 'mid'
-                ELSE 'low'
-            END as price_tier
-        FROM cost_calc c
-        JOIN latest_prices lp ON c.stock_id = lp.stock_id
-        WHERE lp.close_price < (c.weighted_cost / c.total_shares)  -- 現價低於平均成本
-          AND c.buy_days >= 3  -- 至少有3天買進記錄
-    ),
-    ranked AS (
-        SELECT
-            *,
-            ROW_NUMBER() OVER (PARTITION BY price_tier ORDER BY discount_pct ASC) as rank
-        FROM below_cost
-    )
-    INSERT INTO strategy_rankings (
-        stock_id, price_tier, metric_type,
-        avg_return, win_rate, signal_count, current_price, rank_in_tier
+    if costs is None:
+        costs = compute_cost_metrics(db, lookback_days)
+
+    # 現價低於平均成本，且至少有3天買進記錄
+    below = costs[(costs["current_price"] < costs["avg_cost"]) & (costs["buy_days"] >= 3)]
+    below = below.assign(
+        discount_pct=_round2((below["current_price"] - below["avg_cost"]) / below["avg_cost"] * 100),
+        avg_cost=_round2(below["avg_cost"]),
     )
-    SELECT
-        stock_id, price_tier, :metric_type,
-        avg_cost,       -- 借用 avg_return 欄位存平均成本
-        discount_pct,   -- 借用 win_rate 欄位存折價率
-        buy_days,       -- 借用 signal_count 欄位存買進天數
-        current_price,
-        rank
-    FROM ranked
-    WHERE rank <= 15
-    """)
+    ranked = _rank_per_tier(below, "discount_pct", ascending=True, limit=15)
 
-    result = db.execute(query, {
-        "lookback_days": lookback_days,
-        "metric_type": metric_type
+    count = _insert_rankings(db, metric_type, ranked, {
+        "avg_return": "avg_cost",        # 借用 avg_return 欄位存平均成本
+        "win_rate": "discount_pct",      # 借用 win_rate 欄位存折價率
+        "signal_count": "buy_days",      # 借用 signal_count 欄位存買進天數
     })
-    db.commit()
-    logger.info(f"  Inserted {result.rowcount} rankings for {metric_type}")
-    return result.rowcount
+    if not batched:
+        db.commit()
+    logger.info(f"  Inserted {count} rankings for {metric_type}")
+    return count
+
 
+def compute_stock_technicals(db, batched: bool = False):
+    """
+    Compute and store technical indicators for all stocks with sufficient data.
 
-def compute_stock_technicals(db):
-    """Compute and store technical indicators for all stocks with sufficient data."""
+    The latest 120 prices per stock are COPYed out newest first per stock;
+    every moving average is then one subtraction on a single prefix-sum array
+    (Σ of the first k closes = cs[start + k] - cs[start]).
+    """
     logger.info("Computing stock technicals...")
 
-    # Clear old data
-    db.execute(text("DELETE FROM stock_technicals"))
+    # 每檔只沿 (stock_id, trade_date DESC) index 讀最近 120 筆；
+    # 不在 SQL 編號，每列在該檔的位置由 NumPy 推得
+    prices = _copy_to_frame(db, """
+        SELECT s.id, p.close_price, p.high_price, p.low_price
+        FROM stocks s
+        CROSS JOIN LATERAL (
+            SELECT trade_date, close_price, high_price, low_price
+            FROM stock_prices
+            WHERE stock_id = s.id AND close_price IS NOT NULL
+            ORDER BY trade_date DESC
+            LIMIT 120
+        ) p
+        ORDER BY s.id, p.trade_date DESC
+    """, {
+        "stock_id": np.int64,
+        "close_price": np.float64, "high_price": np.float64, "low_price": np.float64,
+    })
+    columns = ["stock_id", "ma5", "ma10", "ma20", "ma60", "ma120", "support1", "resistance1"]
+    if prices.empty:
+        result = pd.DataFrame(columns=columns)
+    else:
+        result = _technicals_from_prices(prices)
 
-    query = text("""
-    WITH price_data AS (
-        SELECT
-            p.stock_id,
-            p.trade_date,
-            p.close_price,
-            p.high_price,
-            p.low_price,
-            ROW_NUMBER() OVER (PARTITION BY p.stock_id ORDER BY p.trade_date DESC) as rn
-        FROM stock_prices p
-        WHERE p.close_price IS NOT NULL
-    ),
-    ma_data AS (
-        SELECT
-            stock_id,
-            AVG(CASE WHEN rn <= 5 THEN close_price END) as ma5,
-            AVG(CASE WHEN rn <= 10 THEN close_price END) as ma10,
-            AVG(CASE WHEN rn <= 20 THEN close_price END) as ma20,
-            AVG(CASE WHEN rn <= 60 THEN close_price END) as ma60,
-            AVG(CASE WHEN rn <= 120 THEN close_price END) as ma120,
-            MAX(CASE WHEN rn <= 20 THEN high_price END) as high_20,
-            MIN(CASE WHEN rn <= 20 THEN low_price END) as low_20,
-            MAX(CASE WHEN rn = 1 THEN close_price END) as current_close,
-            COUNT(*) as price_count
-        FROM price_data
-        WHERE rn <= 120
-        GROUP BY stock_id
-        HAVING COUNT(*) >= 5
-    )
-    INSERT INTO stock_technicals (stock_id, ma5, ma10, ma20, ma60, ma120, support1, resistance1)
-    SELECT
-        stock_id,
-        ROUND(ma5, 2),
-        ROUND(ma10, 2),
-        ROUND(ma20, 2),
-        ROUND(ma60, 2),
-        ROUND(ma120, 2),
-        ROUND(low_20, 2) as support1,
-        ROUND(high_20, 2) as resistance1
-    FROM ma_data
-    """)
+    # Clear old data：整表重寫，TRUNCATE 不留死列也不逐列寫 WAL。
+    # TRUNCATE 取得 ACCESS EXCLUSIVE 鎖直到 commit，期間 API 讀取會等待，
+    # 因此計算完成後才執行，鎖只涵蓋 COPY 寫入
+    db.execute(text("TRUNCATE TABLE stock_technicals RESTART IDENTITY"))
+    if not result.empty:
+        # NaN (無高低價資料) 以空字串寫出，COPY 讀成 NULL
+        _copy_from_frame(db, "stock_technicals", result[columns], columns)
+    if not batched:
+        db.commit()
+    logger.info(f"  Updated {len(result)} stock technicals")
+    return len(result)
 
-    result = db.execute(query)
-    db.commit()
-    logger.info(f"  Updated {result.rowcount} stock technicals")
-    return result.rowcount
 
+def _technicals_from_prices(prices: pd.DataFrame) -> pd.DataFrame:
+    """Moving averages and 20-day support/resistance per stock from the COPYed prices."""
+    stock_ids = prices["stock_id"].to_numpy()
+    # 收盤價為 DECIMAL(12,2)，以整數「分」累加，前綴和相減沒有浮點誤差
+    cents = np.rint(prices["close_price"].to_numpy() * 100).astype(np.int64)
+    starts = np.flatnonzero(np.r_[True, stock_ids[1:] != stock_ids[:-1]])
+    counts = np.diff(np.r_[starts, len(stock_ids)])
+    prefix = np.r_[0, np.cumsum(cents)]
+
+    # 資料不足 k 筆時與 AVG 相同，取現有筆數平均
+    technicals = {"stock_id": stock_ids[starts]}
+    for k in (5, 10, 20, 60, 120):
+        n = np.minimum(k, counts)
+        total = prefix[starts + n] - prefix[starts]
+        # 整數除法四捨五入到分 (價格皆為正)，與 SQL ROUND(AVG(numeric), 2) 一致
+        technicals[f"ma{k}"] = (2 * total + n) // (2 * n) / 100
+
+    # 近 20 日高低點：每檔最前面 20 列，
+    # 壓縮後第 i 檔從 Σ min(20, counts[:i]) 開始
+    recent = np.arange(len(stock_ids)) - np.repeat(starts, counts) < 20
+    recent_starts = np.r_[0, np.cumsum(np.minimum(20, counts))[:-1]]
+    technicals["resistance1"] = np.fmax.reduceat(prices["high_price"].to_numpy()[recent], recent_starts)
+    technicals["support1"] = np.fmin.reduceat(prices["low_price"].to_numpy()[recent], recent_starts)
 
-def compute_consecutive_buying(db, min_days: int = 5):
+    return pd.DataFrame(technicals)[counts >= 5]
+
+
+def compute_consecutive_buying(db, min_days: int = 5, batched: bool = False):
     """
     計算外資連續買超排行。
     找出外資連續買超天數最多的股票。
@@ -332,66 +784,50 @@ def compute_consecutive_buying(db, min_days: int = 5):
     metric_type = "consecutive_buying"
     logger.info(f"Computing {metric_type}...")
 
-    db.execute(text("DELETE FROM strategy_rankings WHERE metric_type = :metric_type"),
-               {"metric_type": metric_type})
+    if not batched:
+        db.execute(DELETE_METRIC_STMT, {"metric_type": metric_type})
 
-    query = text("""
-    WITH latest_prices AS (
-        SELECT DISTINCT ON (stock_id)
-            stock_id, close_price, trade_date
-        FROM stock_prices
-        ORDER BY stock_id, trade_date DESC
-    ),
-    -- 計算每個股票最近的連續買超天數
+    query = text(f"""
+    WITH
+    -- 每個股票由近到遠編號
     consecutive AS (
         SELECT
             f.stock_id,
-            f.trade_date,
             f.foreign_net,
-            CASE WHEN f.foreign_net > 0 THEN 1 ELSE 0 END as is_buy,
             ROW_NUMBER() OVER (PARTITION BY f.stock_id ORDER BY f.trade_date DESC) as rn
-        FROM institutional_flows f
-        WHERE f.trade_date >= CURRENT_DATE - 30
+        FROM recent_institutional_flows f
+        WHERE f.trade_date >= :cutoff
     ),
-    -- 找出連續買超的起點
-    streak_calc AS (
+    -- 最近一個非買超日的位置，之前的都是連續買超
+    streak_end AS (
         SELECT
             stock_id,
-            COUNT(*) FILTER (WHERE is_buy = 1) as consecutive_days,
-            SUM(foreign_net) FILTER (WHERE is_buy = 1) as total_net_buy
-        FROM (
-            SELECT *,
-                SUM(CASE WHEN is_buy = 0 THEN 1 ELSE 0 END) OVER (
-                    PARTITION BY stock_id ORDER BY rn
-                ) as grp
-            FROM consecutive
-        ) sub
-        WHERE grp = 0 AND is_buy = 1
+            MIN(rn) FILTER (WHERE (foreign_net > 0) IS NOT TRUE) as first_non_buy
+        FROM consecutive
         GROUP BY stock_id
+    ),
+    streak_calc AS (
+        SELECT
+            c.stock_id,
+            COUNT(*) as consecutive_days,
+            SUM(c.foreign_net) as total_net_buy
+        FROM consecutive c
+        JOIN streak_end e ON c.stock_id = e.stock_id
+        WHERE c.rn < COALESCE(e.first_non_buy, c.rn + 1)
+        GROUP BY c.stock_id
         HAVING COUNT(*) >= :min_days
     ),
-    ranked AS (
+    combined AS (
         SELECT
             sc.stock_id,
             lp.close_price as current_price,
             sc.consecutive_days,
             sc.total_net_buy,
-            CASE
-                WHEN lp.close_price >= 500 THEN 'high'
-                WHEN lp.close_price >= 200 THEN 'mid'
-                ELSE 'low'
-            END as price_tier,
-            ROW_NUMBER() OVER (
-                PARTITION BY CASE
-                    WHEN lp.close_price >= 500 THEN 'high'
-                    WHEN lp.close_price >= 200 THEN 'mid'
-                    ELSE 'low'
-                END
-                ORDER BY sc.consecutive_days DESC, sc.total_net_buy DESC
-            ) as rank
+            lp.price_tier
         FROM streak_calc sc
-        JOIN latest_prices lp ON sc.stock_id = lp.stock_id
-    )
+        JOIN latest_stock_prices lp ON sc.stock_id = lp.stock_id
+    ),
+    {_top_per_tier("combined", "consecutive_days DESC, total_net_buy DESC", 15)}
     INSERT INTO strategy_rankings (
         stock_id, price_tier, metric_type,
         signal_count, avg_return, current_price, rank_in_tier
@@ -402,16 +838,16 @@ def compute_consecutive_buying(db, min_days: int = 5):
         total_net_buy,     -- 借用 avg_return 存總買超量
         current_price, rank
     FROM ranked
-    WHERE rank <= 15
     """)
 
-    result = db.execute(query, {"min_days": min_days, "metric_type": metric_type})
-    db.commit()
+    result = db.execute(query, {"min_days": min_days, "cutoff": _cutoff(db, 30), "metric_type": metric_type})
+    if not batched:
+        db.commit()
     logger.info(f"  Inserted {result.rowcount} rankings for {metric_type}")
     return result.rowcount
 
 
-def compute_trust_accumulation(db, lookback_days: int = 20):
+def compute_trust_accumulation(db, lookback_days: int = 20, batched: bool = False):
     """
     計算投信認養股排行。
     找出投信近期持續加碼、持股比例創新高的股票。
@@ -419,16 +855,11 @@ def compute_trust_accumulation(db, lookback_days: int = 20):
     metric_type = "trust_accumulation"
     logger.info(f"Computing {metric_type}...")
 
-    db.execute(text("DELETE FROM strategy_rankings WHERE metric_type = :metric_type"),
-               {"metric_type": metric_type})
+    if not batched:
+        db.execute(DELETE_METRIC_STMT, {"metric_type": metric_type})
 
-    query = text("""
-    WITH latest_prices AS (
-        SELECT DISTINCT ON (stock_id)
-            stock_id, close_price
-        FROM stock_prices
-        ORDER BY stock_id, trade_date DESC
-    ),
+    query = text(f"""
+    WITH
     -- 計算投信近期買超情況
     trust_activity AS (
         SELECT
@@ -437,8 +868,8 @@ def compute_trust_accumulation(db, lookback_days: int = 20):
             COUNT(*) FILTER (WHERE f.trust_net > 0) as buy_days,
             COUNT(*) as total_days,
             SUM(f.trust_net) FILTER (WHERE f.trust_net > 0) as total_buy_amount
-        FROM institutional_flows f
-        WHERE f.trade_date >= CURRENT_DATE - :lookback_days
+        FROM recent_institutional_flows f
+        WHERE f.trade_date >= :cutoff
         GROUP BY f.stock_id
         HAVING SUM(f.trust_net) > 0
            AND COUNT(*) FILTER (WHERE f.trust_net > 0) >= 3
@@ -447,10 +878,10 @@ def compute_trust_accumulation(db, lookback_days: int = 20):
     ratio_change AS (
         SELECT
             r.stock_id,
-            MAX(r.trust_ratio_est) FILTER (WHERE r.trade_date >= CURRENT_DATE - 5) as recent_ratio,
-            AVG(r.trust_ratio_est) FILTER (WHERE r.trade_date < CURRENT_DATE - 5) as prev_ratio
+            MAX(r.trust_ratio_est) FILTER (WHERE r.trade_date >= :recent_cutoff) as recent_ratio,
+            AVG(r.trust_ratio_est) FILTER (WHERE r.trade_date < :recent_cutoff) as prev_ratio
         FROM institutional_ratios r
-        WHERE r.trade_date >= CURRENT_DATE - :lookback_days
+        WHERE r.trade_date >= :cutoff
         GROUP BY r.stock_id
     ),
     combined AS (
@@ -462,24 +893,12 @@ def compute_trust_accumulation(db, lookback_days: int = 20):
             ta.total_days,
             ROUND(ta.buy_days * 100.0 / NULLIF(ta.total_days, 0), 1) as buy_ratio,
             ROUND((rc.recent_ratio - rc.prev_ratio), 4) as ratio_increase,
-            CASE
-                WHEN lp.close_price >= 500 THEN 'high'
-                WHEN lp.close_price >= 200 THEN 'mid'
-                ELSE 'low'
-            END as price_tier
+            lp.price_tier
         FROM trust_activity ta
-        JOIN latest_prices lp ON ta.stock_id = lp.stock_id
+        JOIN latest_stock_prices lp ON ta.stock_id = lp.stock_id
         LEFT JOIN ratio_change rc ON ta.stock_id = rc.stock_id
     ),
-    ranked AS (
-        SELECT
-            *,
-            ROW_NUMBER() OVER (
-                PARTITION BY price_tier
-                ORDER BY buy_ratio DESC, total_trust_net DESC
-            ) as rank
-        FROM combined
-    )
+    {_top_per_tier("combined", "buy_ratio DESC, total_trust_net DESC", 15)}
     INSERT INTO strategy_rankings (
         stock_id, price_tier, metric_type,
         signal_count, avg_return, win_rate, current_price, rank_in_tier
@@ -491,16 +910,20 @@ def compute_trust_accumulation(db, lookback_days: int = 20):
         buy_ratio,          -- 買超比例
         current_price, rank
     FROM ranked
-    WHERE rank <= 15
     """)
 
-    result = db.execute(query, {"lookback_days": lookback_days, "metric_type": metric_type})
-    db.commit()
+    result = db.execute(query, {
+        "cutoff": _cutoff(db, lookback_days),
+        "recent_cutoff": _cutoff(db, 5),
+        "metric_type": metric_type,
+    })
+    if not batched:
+        db.commit()
     logger.info(f"  Inserted {result.rowcount} rankings for {metric_type}")
     return result.rowcount
 
 
-def compute_synchronized_buying(db, lookback_days: int = 10):
+def compute_synchronized_buying(db, lookback_days: int = 10, batched: bool = False):
     """
     計算三大法人同步買超排行。
     找出外資、投信、自營商同時買超的股票。
@@ -508,16 +931,11 @@ def compute_synchronized_buying(db, lookback_days: int = 10):
     metric_type = "synchronized_buying"
     logger.info(f"Computing {metric_type}...")
 
-    db.execute(text("DELETE FROM strategy_rankings WHERE metric_type = :metric_type"),
-               {"metric_type": metric_type})
+    if not batched:
+        db.execute(DELETE_METRIC_STMT, {"metric_type": metric_type})
 
-    query = text("""
-    WITH latest_prices AS (
-        SELECT DISTINCT ON (stock_id)
-            stock_id, close_price
-        FROM stock_prices
-        ORDER BY stock_id, trade_date DESC
-    ),
+    query = text(f"""
+    WITH
     -- 找出三大法人同步買超的日子
     sync_days AS (
         SELECT
@@ -526,9 +944,9 @@ def compute_synchronized_buying(db, lookback_days: int = 10):
             f.foreign_net,
             f.trust_net,
             f.dealer_net,
-            f.foreign_net + f.trust_net + f.dealer_net as total_net
-        FROM institutional_flows f
-        WHERE f.trade_date >= CURRENT_DATE - :lookback_days
+            f.total_net
+        FROM recent_institutional_flows f
+        WHERE f.trade_date >= :cutoff
           AND f.foreign_net > 0
           AND f.trust_net > 0
           AND f.dealer_net > 0
@@ -555,23 +973,11 @@ def compute_synchronized_buying(db, lookback_days: int = 10):
             ss.foreign_total,
             ss.trust_total,
             ss.dealer_total,
-            CASE
-                WHEN lp.close_price >= 500 THEN 'high'
-                WHEN lp.close_price >= 200 THEN 'mid'
-                ELSE 'low'
-            END as price_tier
+            lp.price_tier
         FROM sync_stats ss
-        JOIN latest_prices lp ON ss.stock_id = lp.stock_id
+        JOIN latest_stock_prices lp ON ss.stock_id = lp.stock_id
     ),
-    ranked AS (
-        SELECT
-            *,
-            ROW_NUMBER() OVER (
-                PARTITION BY price_tier
-                ORDER BY sync_days_count DESC, total_sync_amount DESC
-            ) as rank
-        FROM combined
-    )
+    {_top_per_tier("combined", "sync_days_count DESC, total_sync_amount DESC", 15)}
     INSERT INTO strategy_rankings (
         stock_id, price_tier, metric_type,
         signal_count, avg_return, correlation, data_points, current_price, rank_in_tier
@@ -584,133 +990,162 @@ def compute_synchronized_buying(db, lookback_days: int = 10):
         trust_total,          -- 投信買超 (借用 data_points)
         current_price, rank
     FROM ranked
-    WHERE rank <= 15
     """)
 
-    result = db.execute(query, {"lookback_days": lookback_days, "metric_type": metric_type})
-    db.commit()
+    result = db.execute(query, {"cutoff": _cutoff(db, lookback_days), "metric_type": metric_type})
+    if not batched:
+        db.commit()
     logger.info(f"  Inserted {result.rowcount} rankings for {metric_type}")
     return result.rowcount
 
 
-def compute_price_deviation(db, lookback_days: int = 60):
+def compute_price_deviation(
+    db, lookback_days: int = 60, costs: Optional[pd.DataFrame] = None, batched: bool = False
+):
     """
     計算股價乖離過大排行。
     找出股價大幅偏離法人平均成本的股票（可能超漲或超跌）。
+
+    Args:
+        costs: compute_cost_metrics() output to reuse; computed here when omitted
     """
     metric_type = "price_deviation"
     logger.info(f"Computing {metric_type}...")
 
-    db.execute(text("DELETE FROM strategy_rankings WHERE metric_type = :metric_type"),
-               {"metric_type": metric_type})
+    if not batched:
+        db.execute(DELETE_METRIC_STMT, {"metric_type": metric_type})
 
-    query = text("""
-    WITH latest_prices AS (
-        SELECT DISTINCT ON (stock_id)
-            stock_id, close_price, trade_date
-        FROM stock_prices
-        ORDER BY stock_id, trade_date DESC
-    ),
-    -- 計算法人平均成本
-    inst_cost AS (
-        SELECT
-            f.stock_id,
-            SUM(CASE WHEN (f.foreign_net + f.trust_net + f.dealer_net) > 0
-                THEN (f.foreign_net + f.trust_net + f.dealer_net) * p.close_price
-                ELSE 0 END) as weighted_cost,
-            SUM(CASE WHEN (f.foreign_net + f.trust_net + f.dealer_net) > 0
-                THEN (f.foreign_net + f.trust_net + f.dealer_net)
-                ELSE 0 END) as total_shares
-        FROM institutional_flows f
-        JOIN stock_prices p ON f.stock_id = p.stock_id AND f.trade_date = p.trade_date
-        WHERE f.trade_date >= CURRENT_DATE - :lookback_days
-          AND p.close_price > 0
-        GROUP BY f.stock_id
-        HAVING SUM(CASE WHEN (f.foreign_net + f.trust_net + f.dealer_net) > 0
-                   THEN (f.foreign_net + f.trust_net + f.dealer_net) ELSE 0 END) > 0
-    ),
-    deviation_calc AS (
-        SELECT
-            ic.stock_id,
-            lp.close_price as current_price,
-            ROUND(ic.weighted_cost / ic.total_shares, 2) as avg_cost,
-            ROUND((lp.close_price - ic.weighted_cost / ic.total_shares)
-                  / (ic.weighted_cost / ic.total_shares) * 100, 2) as deviation_pct,
-            CASE
-                WHEN lp.close_price >= 500 THEN 'high'
-                WHEN lp.close_price >= 200 THEN 'mid'
-                ELSE 'low'
-            END as price_tier
-        FROM inst_cost ic
-        JOIN latest_prices lp ON ic.stock_id = lp.stock_id
-        WHERE ABS((lp.close_price - ic.weighted_cost / ic.total_shares)
-              / (ic.weighted_cost / ic.total_shares) * 100) >= 10  -- 乖離超過10%
-    ),
-    ranked AS (
-        SELECT
-            *,
-            ROW_NUMBER() OVER (
-                PARTITION BY price_tier
-                ORDER BY ABS(deviation_pct) DESC
-            ) as rank
-        FROM deviation_calc
-    )
-    INSERT INTO strategy_rankings (
-        stock_id, price_tier, metric_type,
-        avg_return, win_rate, current_price, rank_in_tier
+    if costs is None:
+        costs = compute_cost_metrics(db, lookback_days)
+
+    deviation = (costs["current_price"] - costs["avg_cost"]) / costs["avg_cost"] * 100
+    # 乖離超過10%
+    deviated = costs[deviation.abs() >= 10].assign(
+        deviation_pct=_round2(deviation),
+        avg_cost=_round2(costs["avg_cost"]),
     )
-    SELECT
-        stock_id, price_tier, :metric_type,
-        avg_cost,        -- 法人成本
-        deviation_pct,   -- 乖離率
-        current_price, rank
-    FROM ranked
-    WHERE rank <= 15
-    """)
+    deviated = deviated.assign(abs_deviation=deviated["deviation_pct"].abs())
+    ranked = _rank_per_tier(deviated, "abs_deviation", ascending=False, limit=15)
 
-    result = db.execute(query, {"lookback_days": lookback_days, "metric_type": metric_type})
-    db.commit()
-    logger.info(f"  Inserted {result.rowcount} rankings for {metric_type}")
-    return result.rowcount
+    count = _insert_rankings(db, metric_type, ranked, {
+        "avg_return": "avg_cost",        # 法人成本
+        "win_rate": "deviation_pct",     # 乖離率
+    })
+    if not batched:
+        db.commit()
+    logger.info(f"  Inserted {count} rankings for {metric_type}")
+    return count
 
 
-def run_all_computations(db):
-    """Run all strategy computations."""
-    logger.info("Starting strategy computations...")
+def _run_in_own_session(task: Callable, **kwargs):
+    """Run one computation on its own connection and transaction (thread pool worker)."""
+    db = SessionLocal()
+    try:
+        return task(db, **kwargs)
+    except Exception:
+        db.rollback()
+        raise
+    finally:
+        db.close()
 
-    # Win rate rankings for different periods
-    for days in [5, 10, 30]:
-        compute_win_rate_rankings(db, holding_days=days, min_signals=2)
 
-    # Correlation rankings
-    compute_correlation_rankings(db, min_data_points=5)
+def compute_cost_rankings(db, lookback_days: int = 60, batched: bool = False):
+    """Compute below_cost and price_deviation from one compute_cost_metrics() pass."""
+    costs = compute_cost_metrics(db, lookback_days=lookback_days)
+    return (
+        compute_below_cost_rankings(db, lookback_days=lookback_days, costs=costs, batched=batched)
+        + compute_price_deviation(db, lookback_days=lookback_days, costs=costs, batched=batched)
+    )
 
-    # Below cost rankings (現價低於法人成本)
-    compute_below_cost_rankings(db, lookback_days=60)
 
-    # 新增策略
-    # 外資連續買超
-    compute_consecutive_buying(db, min_days=3)
+def run_all_computations(db, max_workers: int = 4):
+    """
+    Run all strategy computations.
 
-    # 投信認養股
-    compute_trust_accumulation(db, lookback_days=20)
+    The computations are independent, so with max_workers > 1 each runs on
+    its own pooled connection and replaces its metric in its own transaction;
+    wall time approaches the slowest one instead of the sum. max_workers=1
+    runs them in order on `db` as one transaction.
+    """
+    logger.info("Starting strategy computations...")
 
-    # 三大法人同步買超
-    compute_synchronized_buying(db, lookback_days=10)
+    refresh_strategy_views(db)
 
-    # 股價乖離過大
-    compute_price_deviation(db, lookback_days=60)
+    tasks = [
+        # Win rate rankings for different periods. The buy signals are shared
+        # through win_rate_buy_signals; only the exit-price lookups differ, so
+        # the periods stay separate tasks that run concurrently
+        *[(compute_win_rate_rankings, {"holding_days": days, "min_signals": 2})
+          for days in WIN_RATE_HOLDING_DAYS],
+        # Correlation rankings
+        (compute_correlation_rankings, {"min_data_points": 5}),
+        # 現價低於法人成本 / 股價乖離過大 (共用法人平均成本)
+        (compute_cost_rankings, {"lookback_days": 60}),
+        # 外資連續買超
+        (compute_consecutive_buying, {"min_days": 3}),
+        # 投信認養股
+        (compute_trust_accumulation, {"lookback_days": 20}),
+        # 三大法人同步買超
+        (compute_synchronized_buying, {"lookback_days": 10}),
+        # Technical indicators
+        (compute_stock_technicals, {}),
+    ]
 
-    # Technical indicators
-    compute_stock_technicals(db)
+    if max_workers <= 1:
+        _run_batched(db, tasks)
+    else:
+        errors = []
+        with ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="strategy") as executor:
+            futures = {
+                executor.submit(_run_in_own_session, task, **kwargs): task.__name__
+                for task, kwargs in tasks
+            }
+            for future in as_completed(futures):
+                try:
+                    future.result()
+                except Exception as e:
+                    logger.error(f"{futures[future]} failed: {e}")
+                    errors.append(e)
+        if errors:
+            raise errors[0]
 
     logger.info("Strategy computations completed")
 
 
+def _run_batched(db, tasks):
+    """Run every task on `db` in one transaction with a single up-front DELETE."""
+    # 所有排行的舊資料一次清除，整批計算完才 commit
+    metric_types = [f"win_rate_{days}d" for days in WIN_RATE_HOLDING_DAYS] + [
+        "correlation", "below_cost", "consecutive_buying",
+        "trust_accumulation", "synchronized_buying", "price_deviation",
+    ]
+    try:
+        db.execute(DELETE_METRICS_STMT, {"metric_types": metric_types})
+        for task, kwargs in tasks:
+            task(db, batched=True, **kwargs)
+        db.commit()
+    except Exception:
+        db.rollback()
+        raise
+
+
 if __name__ == "__main__":
-    from src.common.database import SessionLocal
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Compute strategy rankings")
+    parser.add_argument(
+        "--rebuild-correlation",
+        action="store_true",
+        help="Rebuild correlation statistics from full history (after corrections to past prices/flows)",
+    )
+    args = parser.parse_args()
+
     db = SessionLocal()
     try:
+        ensure_strategy_schema(db.get_bind())
+        if args.rebuild_correlation:
+            invalidate_correlation_sufstats(db)
+            db.commit()
         run_all_computations(db)
     finally:
         db.close()
@@ -1,4 +1,5 @@
 """Holdings estimation processor."""
+import numpy as np
 import pandas as pd
 from typing import Optional
 
@@ -9,17 +10,15 @@ def build_foreign_master(twse: pd.DataFrame, tpex: pd.DataFrame) -> pd.DataFrame
     if all_df.empty:
         return all_df
 
-    all_df = all_df.sort_values(["code", "date"])
     all_df["date"] = pd.to_datetime(all_df["date"]).dt.date
+    all_df = all_df.sort_values(["code", "date"], ignore_index=True)
 
-    all_df = (
-        all_df.set_index(["code", "date"])
-        .sort_index()
-        .groupby(level=0)
-        .ffill()
-        .reset_index()
-    )
-    return all_df
+    # Forward-fill within each code in one grouped pass, no index rebuild;
+    # grouped by integer code ids like build_estimated_holdings
+    value_cols = [col for col in all_df.columns if col not in ("code", "date")]
+    codes = pd.factorize(all_df["code"])[0]
+    all_df[value_cols] = all_df.groupby(codes, sort=False)[value_cols].ffill()
+    return all_df[["code", "date", *value_cols]]
 
 
 def build_estimated_holdings(
@@ -29,35 +28,39 @@ def build_estimated_holdings(
 ) -> pd.DataFrame:
     """Build institutional holdings estimation with baseline correction.
 
+    The ETL ratio step computes the same estimate in SQL
+    (ratios.compute_ratios_from_db); this in-memory version is fully
+    vectorized over all stocks for DataFrames that are not in the database.
+
     Args:
         flows: DataFrame with daily institutional flows
         foreign_master: DataFrame with foreign holdings data
         baseline: Optional DataFrame with baseline calibration points
 
     Returns:
-        DataFrame with estimated holdings ratios
+        DataFrame with estimated holdings ratios, ordered by code and date
     """
-    flows = flows.copy()
-    flows["date"] = pd.to_datetime(flows["date"]).dt.date
-    foreign_master = foreign_master.copy()
-    foreign_master["date"] = pd.to_datetime(foreign_master["date"]).dt.date
+    # assign() only replaces the date column instead of copying whole frames
+    flows = flows.assign(date=pd.to_datetime(flows["date"]).dt.date)
+    foreign = foreign_master[["date", "code", "market", "total_shares", "foreign_ratio"]]
+    foreign = foreign.assign(date=pd.to_datetime(foreign["date"]).dt.date)
 
     # Merge flows with foreign holdings
     merged = flows.merge(
-        foreign_master[["date", "code", "market", "total_shares", "foreign_ratio"]],
+        foreign,
         on=["date", "code", "market"],
         how="left",
     )
 
     # Handle baseline data
     if baseline is not None and not baseline.empty and "date" in baseline.columns:
-        base = baseline.copy()
-        base["date"] = pd.to_datetime(base["date"], format="%Y-%m-%d", errors="coerce")
-        base = base.dropna(subset=["date"])
+        base = baseline[["date", "code", "trust_shares_base", "dealer_shares_base"]]
+        base = base.assign(
+            date=pd.to_datetime(base["date"], format="%Y-%m-%d", errors="coerce")
+        ).dropna(subset=["date"])
         if not base.empty:
-            base["date"] = base["date"].dt.date
             merged = merged.merge(
-                base[["date", "code", "trust_shares_base", "dealer_shares_base"]],
+                base.assign(date=base["date"].dt.date),
                 on=["date", "code"],
                 how="left",
             )
@@ -71,54 +74,61 @@ def build_estimated_holdings(
     merged = merged.sort_values(["code", "date"])
     merged["total_shares"] = pd.to_numeric(merged["total_shares"], errors="coerce").fillna(0.0)
 
-    def accumulate(group: pd.DataFrame) -> pd.DataFrame:
-        g = group.copy()
-        g["trust_net"] = g["trust_net"].astype(float)
-        g["dealer_net"] = g["dealer_net"].astype(float)
-
-        g["trust_cum"] = g["trust_net"].cumsum()
-        g["dealer_cum"] = g["dealer_net"].cumsum()
-
-        base_trust = pd.to_numeric(g["trust_shares_base"], errors="coerce").fillna(0.0)
-        base_dealer = pd.to_numeric(g["dealer_shares_base"], errors="coerce").fillna(0.0)
-
-        base_trust_ff = base_trust.ffill().fillna(0.0)
-        base_dealer_ff = base_dealer.ffill().fillna(0.0)
-
-        trust_cum_at_base = g["trust_cum"].where(g["trust_shares_base"].notna()).ffill().fillna(0.0)
-        dealer_cum_at_base = g["dealer_cum"].where(g["dealer_shares_base"].notna()).ffill().fillna(0.0)
-
-        g["trust_shares_est"] = base_trust_ff + (g["trust_cum"] - trust_cum_at_base)
-        g["dealer_shares_est"] = base_dealer_ff + (g["dealer_cum"] - dealer_cum_at_base)
-
-        # Fallback to pure cumsum if no baseline
-        mask_no_base = (base_trust_ff == 0.0) & (base_dealer_ff == 0.0)
-        if mask_no_base.all():
-            g["trust_shares_est"] = g["trust_cum"]
-            g["dealer_shares_est"] = g["dealer_cum"]
+    # Cumulative net flows per stock, computed over the whole frame at once
+    merged["trust_net"] = merged["trust_net"].astype(float)
+    merged["dealer_net"] = merged["dealer_net"].astype(float)
+    # Integer group ids, so the grouped passes below skip hashing code strings
+    codes = pd.factorize(merged["code"])[0]
+    by_code = merged.groupby(codes, sort=False)
+    merged["trust_cum"] = by_code["trust_net"].cumsum()
+    merged["dealer_cum"] = by_code["dealer_net"].cumsum()
+
+    # Anchor each row to the latest baseline on or before it:
+    # est = baseline + (cum - cum on the baseline day)
+    has_trust_base = merged["trust_shares_base"].notna()
+    has_dealer_base = merged["dealer_shares_base"].notna()
+    base_trust_ff = (
+        pd.to_numeric(merged["trust_shares_base"], errors="coerce")
+        .groupby(codes, sort=False).ffill().fillna(0.0)
+    )
+    base_dealer_ff = (
+        pd.to_numeric(merged["dealer_shares_base"], errors="coerce")
+        .groupby(codes, sort=False).ffill().fillna(0.0)
+    )
+    trust_cum_at_base = (
+        merged["trust_cum"].where(has_trust_base)
+        .groupby(codes, sort=False).ffill().fillna(0.0)
+    )
+    dealer_cum_at_base = (
+        merged["dealer_cum"].where(has_dealer_base)
+        .groupby(codes, sort=False).ffill().fillna(0.0)
+    )
 
-        return g
+    merged["trust_shares_est"] = base_trust_ff + (merged["trust_cum"] - trust_cum_at_base)
+    merged["dealer_shares_est"] = base_dealer_ff + (merged["dealer_cum"] - dealer_cum_at_base)
 
-    merged = merged.groupby("code", group_keys=False).apply(accumulate)
+    # Fallback to pure cumsum for stocks without any non-zero baseline
+    no_base = ((base_trust_ff == 0.0) & (base_dealer_ff == 0.0)).groupby(codes, sort=False).transform("all")
+    merged.loc[no_base, "trust_shares_est"] = merged.loc[no_base, "trust_cum"]
+    merged.loc[no_base, "dealer_shares_est"] = merged.loc[no_base, "dealer_cum"]
 
-    # Calculate ratios
-    denom = merged["total_shares"].astype("float64")
+    # Calculate ratios on plain float64 arrays; rows without total_shares stay 0
+    denom = merged["total_shares"].to_numpy(dtype=np.float64)
     valid = denom > 0.0
 
-    merged["trust_ratio_est"] = 0.0
-    merged["dealer_ratio_est"] = 0.0
-
-    merged.loc[valid, "trust_ratio_est"] = (
-        merged.loc[valid, "trust_shares_est"].astype(float) / denom[valid] * 100.0
-    )
-    merged.loc[valid, "dealer_ratio_est"] = (
-        merged.loc[valid, "dealer_shares_est"].astype(float) / denom[valid] * 100.0
-    )
+    trust_ratio = np.zeros_like(denom)
+    dealer_ratio = np.zeros_like(denom)
+    np.divide(merged["trust_shares_est"].to_numpy(dtype=np.float64), denom, out=trust_ratio, where=valid)
+    np.divide(merged["dealer_shares_est"].to_numpy(dtype=np.float64), denom, out=dealer_ratio, where=valid)
+    trust_ratio *= 100.0
+    dealer_ratio *= 100.0
 
     # Convert foreign_ratio from Decimal to float for arithmetic operations
-    merged["foreign_ratio"] = merged["foreign_ratio"].fillna(0.0).astype(float)
-    merged["three_inst_ratio_est"] = (
-        merged["foreign_ratio"] + merged["trust_ratio_est"] + merged["dealer_ratio_est"]
-    )
+    foreign_ratio = merged["foreign_ratio"].fillna(0.0).to_numpy(dtype=np.float64)
+
+    merged["trust_ratio_est"] = trust_ratio
+    merged["dealer_ratio_est"] = dealer_ratio
+    merged["foreign_ratio"] = foreign_ratio
+    merged["three_inst_ratio_est"] = foreign_ratio + trust_ratio + dealer_ratio
 
     return merged
@@ -1,18 +1,32 @@
 """Ratio computation and change metrics processor."""
-from typing import List
+import io
+from datetime import date
+from typing import List, Optional
+import numpy as np
 import pandas as pd
-from sqlalchemy import text
+
+# pyarrow import with fallback
+try:
+    import pyarrow  # noqa: F401
+    HAS_PYARROW = True
+except ImportError:
+    HAS_PYARROW = False
 
 from src.common.database import get_db_session
 from src.common.config import settings
 
 
-def add_change_metrics(merged: pd.DataFrame, windows: List[int] = None) -> pd.DataFrame:
+def add_change_metrics(
+    merged: pd.DataFrame, windows: List[int] = None, presorted: bool = False
+) -> pd.DataFrame:
     """Add change metrics for multiple windows.
 
     Args:
         merged: DataFrame with three_inst_ratio_est column
         windows: List of window sizes (default: [5, 20, 60, 120])
+        presorted: merged is already ordered by code, date (as returned by
+            build_estimated_holdings); skips the sort, and the change
+            columns are then added to merged itself
 
     Returns:
         DataFrame with change columns added
@@ -20,113 +34,167 @@ def add_change_metrics(merged: pd.DataFrame, windows: List[int] = None) -> pd.Da
     if windows is None:
         windows = settings.windows
 
-    merged = merged.sort_values(["code", "date"])
-
-    def add_all(group: pd.DataFrame) -> pd.DataFrame:
-        g = group.copy()
-        for w in windows:
-            col = f"three_inst_ratio_change_{w}"
-            g[col] = g["three_inst_ratio_est"].diff(periods=w)
-        return g
-
-    merged = merged.groupby("code", group_keys=False).apply(add_all)
+    if not presorted:
+        merged = merged.sort_values(["code", "date"])
+
+    # 依 code, date 排序後每檔連續：一次求出每列在該檔內的位置，
+    # 各 window 只是同一陣列往前 w 列的相減，不必每個 window 再分組 shift
+    ratio = merged["three_inst_ratio_est"].to_numpy(dtype=float, na_value=np.nan)
+    codes = pd.factorize(merged["code"])[0]
+    n = len(ratio)
+    rows = np.arange(n)
+    is_start = np.ones(n, dtype=bool)
+    is_start[1:] = codes[1:] != codes[:-1]
+    starts = np.flatnonzero(is_start)
+    position = rows - np.repeat(starts, np.diff(np.append(starts, n)))
+
+    for w in windows:
+        change = np.full(n, np.nan)
+        has_prev = position >= w
+        change[has_prev] = ratio[has_prev] - ratio[rows[has_prev] - w]
+        merged[f"three_inst_ratio_change_{w}"] = change
     return merged
 
 
-def compute_ratios_from_db() -> pd.DataFrame:
+def compute_ratios_from_db(start_date: Optional[date] = None) -> pd.DataFrame:
     """Compute institutional ratios directly from database.
 
-    Queries flows and foreign_holdings tables and computes estimated ratios.
+    SQL counterpart of build_foreign_master + build_estimated_holdings +
+    add_change_metrics: foreign holdings are forward-filled per stock,
+    cumulative trust/dealer flows are anchored to the latest row of
+    institutional_baselines (see sync_baselines), and ratios and change
+    metrics are computed with window functions, so only the final rows
+    reach pandas. Only the columns upsert_ratios needs (plus total_shares)
+    are returned; stocks is joined once at the end for the code. The result
+    is streamed with COPY ... TO STDOUT and parsed by read_csv, skipping the
+    per-row Python tuples of fetchall().
+
+    Args:
+        start_date: First trade date to load; cumulative sums start here
+            (default: all history)
 
     Returns:
-        DataFrame with computed ratios ready for upsert
+        DataFrame with computed ratios ready for upsert, in no particular order
     """
-    query = text("""
-        WITH flows_data AS (
-            SELECT
-                f.stock_id,
-                f.trade_date,
-                s.code,
-                s.name,
-                s.market,
-                f.foreign_net,
-                f.trust_net,
-                f.dealer_net
-            FROM institutional_flows f
-            JOIN stocks s ON f.stock_id = s.id
-        ),
-        holdings_data AS (
+    # COPY 不接受 bind 參數，日期以 literal 帶入
+    since = f"DATE '{start_date.isoformat()}'" if start_date else "DATE '-infinity'"
+    change_cols = ",\n".join(
+        f"            three_inst_ratio_est - LAG(three_inst_ratio_est, {int(w)}) OVER w"
+        f" as three_inst_ratio_change_{int(w)}"
+        for w in settings.windows
+    )
+    query = f"""
+        WITH foreign_window AS (
             SELECT
                 h.stock_id,
                 h.trade_date,
                 h.total_shares,
-                h.foreign_ratio
+                h.foreign_ratio,
+                -- 非空值累計數相同的列屬於同一段，段內只有第一列有值
+                COUNT(h.total_shares) OVER w as shares_grp,
+                COUNT(h.foreign_ratio) OVER w as ratio_grp
             FROM foreign_holdings h
+            WHERE h.trade_date >= {since}
+            WINDOW w AS (PARTITION BY h.stock_id ORDER BY h.trade_date ROWS UNBOUNDED PRECEDING)
+        ),
+        -- 外資持股缺值沿用同檔前一筆 (forward-fill)
+        foreign_ff AS (
+            SELECT
+                stock_id,
+                trade_date,
+                MAX(total_shares) OVER (PARTITION BY stock_id, shares_grp) as total_shares,
+                MAX(foreign_ratio) OVER (PARTITION BY stock_id, ratio_grp) as foreign_ratio
+            FROM foreign_window
         ),
         merged AS (
             SELECT
                 f.stock_id,
                 f.trade_date,
-                f.code,
-                f.name,
-                f.market,
                 f.foreign_net,
                 f.trust_net,
                 f.dealer_net,
                 COALESCE(h.total_shares, 0) as total_shares,
-                COALESCE(h.foreign_ratio, 0) as foreign_ratio
-            FROM flows_data f
-            LEFT JOIN holdings_data h ON f.stock_id = h.stock_id AND f.trade_date = h.trade_date
+                COALESCE(h.foreign_ratio, 0)::float8 as foreign_ratio,
+                b.trust_shares_base,
+                b.dealer_shares_base,
+                (SUM(f.trust_net) OVER w)::float8 as trust_cum,
+                (SUM(f.dealer_net) OVER w)::float8 as dealer_cum,
+                COUNT(b.trust_shares_base) OVER w as trust_grp,
+                COUNT(b.dealer_shares_base) OVER w as dealer_grp
+            FROM institutional_flows f
+            LEFT JOIN foreign_ff h ON f.stock_id = h.stock_id AND f.trade_date = h.trade_date
+            LEFT JOIN institutional_baselines b
+                ON f.stock_id = b.stock_id AND f.trade_date = b.baseline_date
+            WHERE f.trade_date >= {since}
+            WINDOW w AS (PARTITION BY f.stock_id ORDER BY f.trade_date ROWS UNBOUNDED PRECEDING)
+        ),
+        -- 每列對應最近一個基準點：基準持股與基準日當天的累計買賣超
+        anchored AS (
+            SELECT
+                *,
+                COALESCE(MAX(trust_shares_base) OVER tw, 0)::float8 as base_trust,
+                COALESCE(MAX(dealer_shares_base) OVER dw, 0)::float8 as base_dealer,
+                COALESCE(MAX(trust_cum) FILTER (WHERE trust_shares_base IS NOT NULL) OVER tw, 0)
+                    as trust_cum_at_base,
+                COALESCE(MAX(dealer_cum) FILTER (WHERE dealer_shares_base IS NOT NULL) OVER dw, 0)
+                    as dealer_cum_at_base
+            FROM merged
+            WINDOW tw AS (PARTITION BY stock_id, trust_grp), dw AS (PARTITION BY stock_id, dealer_grp)
+        ),
+        holdings AS (
+            SELECT
+                *,
+                -- 整檔都沒有非 0 基準點時，直接使用累計買賣超
+                BOOL_AND(base_trust = 0 AND base_dealer = 0) OVER (PARTITION BY stock_id) as no_base
+            FROM anchored
+        ),
+        estimated AS (
+            SELECT
+                stock_id, trade_date, total_shares, foreign_ratio,
+                CASE WHEN no_base THEN trust_cum ELSE base_trust + trust_cum - trust_cum_at_base END
+                    as trust_shares_est,
+                CASE WHEN no_base THEN dealer_cum ELSE base_dealer + dealer_cum - dealer_cum_at_base END
+                    as dealer_shares_est
+            FROM holdings
+        ),
+        ratios AS (
+            SELECT
+                *,
+                CASE WHEN total_shares > 0 THEN trust_shares_est / total_shares * 100.0 ELSE 0.0 END
+                    as trust_ratio_est,
+                CASE WHEN total_shares > 0 THEN dealer_shares_est / total_shares * 100.0 ELSE 0.0 END
+                    as dealer_ratio_est
+            FROM estimated
+        ),
+        three_inst AS (
+            SELECT *, foreign_ratio + trust_ratio_est + dealer_ratio_est as three_inst_ratio_est
+            FROM ratios
         )
-        SELECT * FROM merged
-        ORDER BY code, trade_date
-    """)
+        -- 只在最後一步接上 stocks 取 code，中間各步不帶文字欄位
+        SELECT
+            s.code,
+            t.*,
+{change_cols}
+        FROM three_inst t
+        JOIN stocks s ON t.stock_id = s.id
+        WINDOW w AS (PARTITION BY t.stock_id ORDER BY t.trade_date)
+    """
 
+    # 以 UTF-8 位元組接收 COPY 輸出，不經 Python str 解碼
+    buf = io.BytesIO()
     with get_db_session() as session:
-        result = session.execute(query)
-        rows = result.fetchall()
-
-    if not rows:
+        with session.connection().connection.cursor() as cur:
+            cur.copy_expert(f"COPY ({query}) TO STDOUT WITH (FORMAT csv, HEADER)", buf)
+    buf.seek(0)
+
+    # code 需保留前導 0 (如 0050)，以字串讀入；有 pyarrow 時改用 Arrow 欄位以節省記憶體。
+    # 不用 engine="pyarrow"：它先推斷型別再套 dtype，0050 會變成 50
+    backend = {"dtype_backend": "pyarrow"} if HAS_PYARROW else {}
+    df = pd.read_csv(buf, dtype={"code": str}, parse_dates=["trade_date"], **backend)
+    buf.close()
+    if df.empty:
         return pd.DataFrame()
 
-    df = pd.DataFrame(rows, columns=[
-        "stock_id", "trade_date", "code", "name", "market",
-        "foreign_net", "trust_net", "dealer_net",
-        "total_shares", "foreign_ratio"
-    ])
-
+    df["trade_date"] = df["trade_date"].dt.date
     df["date"] = df["trade_date"]
-
-    # Compute cumulative holdings estimation
-    df = df.sort_values(["code", "date"])
-
-    def compute_cumsum(group: pd.DataFrame) -> pd.DataFrame:
-        g = group.copy()
-        g["trust_net"] = g["trust_net"].astype(float)
-        g["dealer_net"] = g["dealer_net"].astype(float)
-
-        g["trust_shares_est"] = g["trust_net"].cumsum()
-        g["dealer_shares_est"] = g["dealer_net"].cumsum()
-
-        denom = g["total_shares"].astype(float)
-        valid = denom > 0
-
-        g["trust_ratio_est"] = 0.0
-        g["dealer_ratio_est"] = 0.0
-
-        g.loc[valid, "trust_ratio_est"] = g.loc[valid, "trust_shares_est"] / denom[valid] * 100.0
-        g.loc[valid, "dealer_ratio_est"] = g.loc[valid, "dealer_shares_est"] / denom[valid] * 100.0
-
-        g["foreign_ratio"] = g["foreign_ratio"].fillna(0.0)
-        g["three_inst_ratio_est"] = g["foreign_ratio"] + g["trust_ratio_est"] + g["dealer_ratio_est"]
-
-        # Add change metrics
-        for w in settings.windows:
-            col = f"three_inst_ratio_change_{w}"
-            g[col] = g["three_inst_ratio_est"].diff(periods=w)
-
-        return g
-
-    df = df.groupby("code", group_keys=False).apply(compute_cumsum)
-
     return df
@@ -7,15 +7,19 @@ This script:
 4. Computes institutional ratios with baseline correction
 5. Stores everything to PostgreSQL
 """
+import argparse
 import os
 import sys
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from datetime import datetime, timedelta, date
 from zoneinfo import ZoneInfo
-from typing import Optional
+from typing import List, Optional
 import pandas as pd
+from sqlalchemy import text
+from sqlalchemy.orm import Session
 
-from src.common.config import settings
-from src.common.database import get_db_session
+from src.common.database import engine, get_db_session
 from src.common.utils import iter_trading_days
 
 from src.etl.fetchers.twse_flows import fetch_twse_t86
@@ -24,53 +28,88 @@ from src.etl.fetchers.twse_prices import fetch_twse_stock_day_all
 from src.etl.fetchers.tpex_flows import fetch_tpex_flows
 from src.etl.fetchers.tpex_foreign import fetch_tpex_qfii
 from src.etl.fetchers.tpex_prices import fetch_tpex_quotes
+from src.etl.fetchers.cache import read_cached, write_cached
 
 from src.etl.loaders.db_loader import (
     upsert_flows,
     upsert_foreign_holdings,
     upsert_prices,
     upsert_ratios,
+    sync_baselines,
+    prime_stock_cache,
+    clear_stock_cache,
+    get_last_trade_date,
 )
-from src.etl.processors.holdings import build_estimated_holdings, build_foreign_master
-from src.etl.processors.ratios import add_change_metrics
-
+from src.etl.processors.ratios import compute_ratios_from_db
+from src.etl.processors.compute_strategy import ensure_strategy_schema, run_all_computations
+
+
+# Built once; update_etl_status only binds status/message
+ETL_STATUS_START = text("""
+    INSERT INTO system_status (status_key, status_value, message, started_at, updated_at)
+    VALUES ('etl_status', :status, :message, CURRENT_TIMESTAMP, CURRENT_TIMESTAMP)
+    ON CONFLICT (status_key) DO UPDATE SET
+        status_value = :status,
+        message = :message,
+        started_at = CURRENT_TIMESTAMP,
+        completed_at = NULL,
+        updated_at = CURRENT_TIMESTAMP
+""")
+ETL_STATUS_END = text("""
+    UPDATE system_status SET
+        status_value = :status,
+        message = :message,
+        completed_at = CURRENT_TIMESTAMP,
+        updated_at = CURRENT_TIMESTAMP
+    WHERE status_key = 'etl_status'
+""")
+# 完成時通知 LISTEN 中的 broker ETL (run_broker.wait_for_main_etl)；commit 時才送出
+ETL_STATUS_CHANNEL = "etl_status"
+ETL_STATUS_NOTIFY = text(f"SELECT pg_notify('{ETL_STATUS_CHANNEL}', :status)")
+ETL_STATUS_PROGRESS = text("""
+    UPDATE system_status SET
+        status_value = :status,
+        message = :message,
+        updated_at = CURRENT_TIMESTAMP
+    WHERE status_key = 'etl_status'
+""")
+
+
+def update_etl_status(
+    status: str,
+    message: str,
+    is_start: bool = False,
+    is_end: bool = False,
+    session: Optional[Session] = None,
+):
+    """Update ETL status in database for frontend notification.
+
+    Pass session to write through an already open session (committed
+    here) instead of checking out a new one, e.g. for progress heartbeats.
+    The end update also notifies listeners on ETL_STATUS_CHANNEL.
+    """
+    if is_start:
+        query = ETL_STATUS_START
+    elif is_end:
+        query = ETL_STATUS_END
+    else:
+        query = ETL_STATUS_PROGRESS
+    params = {"status": status, "message": message}
 
-def update_etl_status(status: str, message: str, is_start: bool = False, is_end: bool = False):
-    """Update ETL status in database for frontend notification."""
-    from sqlalchemy import text
     try:
-        with get_db_session() as session:
-            if is_start:
-                query = text("""
-                    INSERT INTO system_status (status_key, status_value, message, started_at, updated_at)
-                    VALUES ('etl_status', :status, :message, CURRENT_TIMESTAMP, CURRENT_TIMESTAMP)
-                    ON CONFLICT (status_key) DO UPDATE SET
-                        status_value = :status,
-                        message = :message,
-                        started_at = CURRENT_TIMESTAMP,
-                        completed_at = NULL,
-                        updated_at = CURRENT_TIMESTAMP
-                """)
-            elif is_end:
-                query = text("""
-                    UPDATE system_status SET
-                        status_value = :status,
-                        message = :message,
-                        completed_at = CURRENT_TIMESTAMP,
-                        updated_at = CURRENT_TIMESTAMP
-                    WHERE status_key = 'etl_status'
-                """)
-            else:
-                query = text("""
-                    UPDATE system_status SET
-                        status_value = :status,
-                        message = :message,
-                        updated_at = CURRENT_TIMESTAMP
-                    WHERE status_key = 'etl_status'
-                """)
-            session.execute(query, {"status": status, "message": message})
+        if session is not None:
+            session.execute(query, params)
+            if is_end:
+                session.execute(ETL_STATUS_NOTIFY, params)
             session.commit()
+        else:
+            with get_db_session() as own_session:
+                own_session.execute(query, params)
+                if is_end:
+                    own_session.execute(ETL_STATUS_NOTIFY, params)
     except Exception as e:
+        if session is not None:
+            session.rollback()
         print(f"[WARN] Failed to update ETL status: {e}")
 
 
@@ -93,67 +132,89 @@ def get_target_trade_date() -> date:
     return target
 
 
-def get_last_date_from_db(table_name: str) -> Optional[date]:
-    """Get the most recent date from a database table."""
-    from sqlalchemy import text
-    query = text(f"SELECT MAX(trade_date) FROM {table_name}")
-    with get_db_session() as session:
-        result = session.execute(query).scalar()
-        return result
-
-
-def fetch_flows_for_date(trade_date: date) -> pd.DataFrame:
-    """Fetch institutional flows for a single date from both exchanges."""
-    all_flows = []
-
-    print(f"  Fetching TWSE T86 for {trade_date}...")
-    try:
-        twse_df = fetch_twse_t86(trade_date)
-        if not twse_df.empty:
-            all_flows.append(twse_df)
-            print(f"    Got {len(twse_df)} TWSE records")
-    except Exception as e:
-        print(f"    [WARN] TWSE T86 failed: {e}")
-
-    print(f"  Fetching TPEX flows for {trade_date}...")
-    try:
-        tpex_df = fetch_tpex_flows(trade_date)
-        if not tpex_df.empty:
-            all_flows.append(tpex_df)
-            print(f"    Got {len(tpex_df)} TPEX records")
-    except Exception as e:
-        print(f"    [WARN] TPEX flows failed: {e}")
-
-    if all_flows:
-        return pd.concat(all_flows, ignore_index=True)
-    return pd.DataFrame()
-
-
-def fetch_foreign_for_date(trade_date: date) -> pd.DataFrame:
-    """Fetch foreign holdings for a single date from both exchanges."""
-    all_foreign = []
-
-    print(f"  Fetching TWSE MI_QFIIS for {trade_date}...")
-    try:
-        twse_df = fetch_twse_mi_qfiis(trade_date)
-        if not twse_df.empty:
-            all_foreign.append(twse_df)
-            print(f"    Got {len(twse_df)} TWSE records")
-    except Exception as e:
-        print(f"    [WARN] TWSE MI_QFIIS failed: {e}")
-
-    print(f"  Fetching TPEX QFII for {trade_date}...")
-    try:
-        tpex_df = fetch_tpex_qfii(trade_date)
-        if not tpex_df.empty:
-            all_foreign.append(tpex_df)
-            print(f"    Got {len(tpex_df)} TPEX records")
-    except Exception as e:
-        print(f"    [WARN] TPEX QFII failed: {e}")
+# 每個 (日期, 交易所) 一個請求；各交易所同時在途的請求數有上限以免被限流。
+# T86 / MI_QFIIS / TPEX 三大法人與僑外資端點都是單日全市場快照，沒有區間查詢，
+# 月份彙總只有逐檔版本，請求數反而更多，因此維持逐日並行抓取
+PER_HOST_LIMIT = 3
+_HOST_SLOTS = {
+    "TWSE": threading.BoundedSemaphore(PER_HOST_LIMIT),
+    "TPEX": threading.BoundedSemaphore(PER_HOST_LIMIT),
+}
+
+FLOW_SOURCES = [
+    ("TWSE", "T86", fetch_twse_t86),
+    ("TPEX", "flows", fetch_tpex_flows),
+]
+FOREIGN_SOURCES = [
+    ("TWSE", "MI_QFIIS", fetch_twse_mi_qfiis),
+    ("TPEX", "QFII", fetch_tpex_qfii),
+]
+
+
+def _fetch_from_host(host: str, label: str, fetcher, trade_date: date, use_cache: bool = True) -> pd.DataFrame:
+    """Run one exchange fetcher for one date while holding a slot for that exchange.
+
+    With use_cache, a frame already on disk for (source, trade_date) is
+    returned without a request, and fresh results are written back.
+    """
+    source = f"{host}_{label}".lower()
+    if use_cache:
+        df = read_cached(source, fetcher, trade_date)
+        if df is not None:
+            return df
+
+    with _HOST_SLOTS[host]:
+        df = fetcher(trade_date)
+
+    if use_cache:
+        write_cached(source, fetcher, trade_date, df)
+    return df
+
+
+def fetch_dates_concurrently(
+    sources: List[tuple],
+    dates: List[date],
+    max_workers: int = 2 * PER_HOST_LIMIT,
+    use_cache: bool = True,
+) -> List[pd.DataFrame]:
+    """Fetch every (date, exchange) pair concurrently.
+
+    Each task is one blocking HTTP call on the shared SESSION. Progress is
+    printed from the calling thread as tasks complete; frames are returned
+    in (date, exchange) order so downstream upserts see the same row order
+    as a serial fetch.
+
+    Args:
+        sources: (host, label, fetcher) tuples, e.g. FLOW_SOURCES
+        dates: Trading dates to fetch
+        max_workers: Maximum concurrent requests across all exchanges
+        use_cache: Read and write the on-disk fetch cache
+
+    Returns:
+        Non-empty DataFrames, one per successful (date, exchange) fetch
+    """
+    tasks = [(d, host, label, fetcher) for d in dates for host, label, fetcher in sources]
+    frames: List[Optional[pd.DataFrame]] = [None] * len(tasks)
+
+    with ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="fetch") as executor:
+        futures = {
+            executor.submit(_fetch_from_host, host, label, fetcher, d, use_cache): i
+            for i, (d, host, label, fetcher) in enumerate(tasks)
+        }
+
+        for future in as_completed(futures):
+            i = futures[future]
+            trade_date, host, label, _ = tasks[i]
+            try:
+                df = future.result()
+            except Exception as e:
+                print(f"    [WARN] {host} {label} failed for {trade_date}: {e}")
+                continue
+            if not df.empty:
+                frames[i] = df
+                print(f"    Got {len(df)} {host} {label} records for {trade_date}")
 
-    if all_foreign:
-        return pd.concat(all_foreign, ignore_index=True)
-    return pd.DataFrame()
+    return [df for df in frames if df is not None]
 
 
 def fetch_prices_for_today() -> pd.DataFrame:
@@ -188,7 +249,8 @@ def load_baseline() -> Optional[pd.DataFrame]:
     baseline_path = os.path.join("data", "inst_baseline.csv")
     if os.path.exists(baseline_path):
         try:
-            df = pd.read_csv(baseline_path, comment="#")
+            # code 以字串讀入，保留前導 0 (如 0050)
+            df = pd.read_csv(baseline_path, comment="#", dtype={"code": str})
             if not df.empty:
                 return df
         except Exception as e:
@@ -196,8 +258,12 @@ def load_baseline() -> Optional[pd.DataFrame]:
     return None
 
 
-def run_etl():
-    """Run the complete ETL pipeline."""
+def run_etl(use_cache: bool = True):
+    """Run the complete ETL pipeline.
+
+    Args:
+        use_cache: Reuse flows/foreign frames already fetched for a date
+    """
     print("=" * 60)
     print("Taiwan Institutional Stock Tracker - ETL Pipeline")
     print("=" * 60)
@@ -208,10 +274,16 @@ def run_etl():
     target_date = get_target_trade_date()
     print(f"\n[INFO] Target trade date: {target_date}")
 
+    # Load stock ids once so the upserters skip per-code lookups; rebuilt
+    # per run so a long-lived process does not keep ids of deleted stocks
+    clear_stock_cache()
+    cached = prime_stock_cache()
+    print(f"[INFO] Cached {cached} stock ids")
+
     # Determine date range to fetch
-    last_flow_date = get_last_date_from_db("institutional_flows")
-    last_foreign_date = get_last_date_from_db("foreign_holdings")
-    last_price_date = get_last_date_from_db("stock_prices")
+    last_flow_date = get_last_trade_date("institutional_flows")
+    last_foreign_date = get_last_trade_date("foreign_holdings")
+    last_price_date = get_last_trade_date("stock_prices")
 
     def calc_start(last_date: Optional[date]) -> date:
         if last_date is None:
@@ -229,13 +301,31 @@ def run_etl():
     print(f"[INFO] Foreign update range: {start_foreign} -> {target_date}")
     print(f"[INFO] Last price date: {last_price_date}")
 
-    # Fetch and store flows
-    print("\n[STEP 1] Fetching institutional flows...")
-    all_flows = []
-    for d in iter_trading_days(start_flows, target_date):
-        df = fetch_flows_for_date(d)
-        if not df.empty:
-            all_flows.append(df)
+    flow_dates = iter_trading_days(start_flows, target_date)
+    foreign_dates = iter_trading_days(start_foreign, target_date)
+    # 價格端點回傳當日快照並以 date.today() 標記日期，今天已寫入過就不再抓
+    fetch_prices = last_price_date is None or last_price_date < date.today()
+
+    # STEP 1-3 的抓取互不相依，三者同時進行（flows/foreign 內部再依日期並行，
+    # 共用每個交易所的請求上限）；寫入仍依序執行，避免搶同一批資料列
+    print("\n[STEP 1-3] Fetching institutional flows, foreign holdings and stock prices...")
+    with ThreadPoolExecutor(max_workers=3, thread_name_prefix="step") as executor:
+        flows_future = foreign_future = prices_future = None
+        if flow_dates:
+            flows_future = executor.submit(
+                fetch_dates_concurrently, FLOW_SOURCES, flow_dates, use_cache=use_cache
+            )
+        if foreign_dates:
+            foreign_future = executor.submit(
+                fetch_dates_concurrently, FOREIGN_SOURCES, foreign_dates, use_cache=use_cache
+            )
+        if fetch_prices:
+            prices_future = executor.submit(fetch_prices_for_today)
+
+    # Store flows
+    print("\n[STEP 1] Storing institutional flows...")
+    # 各 (日期, 交易所) 的 frame 直接收進同一個 list，只在寫入前合併一次
+    all_flows = flows_future.result() if flows_future else []
 
     if all_flows:
         flows_df = pd.concat(all_flows, ignore_index=True)
@@ -244,13 +334,9 @@ def run_etl():
     else:
         print("  No new flows to upsert")
 
-    # Fetch and store foreign holdings
-    print("\n[STEP 2] Fetching foreign holdings...")
-    all_foreign = []
-    for d in iter_trading_days(start_foreign, target_date):
-        df = fetch_foreign_for_date(d)
-        if not df.empty:
-            all_foreign.append(df)
+    # Store foreign holdings
+    print("\n[STEP 2] Storing foreign holdings...")
+    all_foreign = foreign_future.result() if foreign_future else []
 
     if all_foreign:
         foreign_df = pd.concat(all_foreign, ignore_index=True)
@@ -259,75 +345,39 @@ def run_etl():
     else:
         print("  No new foreign holdings to upsert")
 
-    # Fetch and store prices
-    print("\n[STEP 3] Fetching stock prices...")
-    prices_df = fetch_prices_for_today()
-    if not prices_df.empty:
-        count = upsert_prices(prices_df)
-        print(f"  Upserted {count} price records to database")
+    # Store prices
+    print("\n[STEP 3] Storing stock prices...")
+    if prices_future is None:
+        print(f"  Prices for {date.today()} already stored, skipped fetch")
     else:
-        print("  No prices to upsert")
+        prices_df = prices_future.result()
+        if not prices_df.empty:
+            count = upsert_prices(prices_df)
+            print(f"  Upserted {count} price records to database")
+        else:
+            print("  No prices to upsert")
 
     # Compute and store ratios
     print("\n[STEP 4] Computing institutional ratios...")
 
-    # Only load recent data for ratio computation (last 180 days for memory efficiency)
+    # Only use recent data for ratio computation (last 180 days)
     ratio_start_date = target_date - timedelta(days=180)
-    print(f"  Loading data from {ratio_start_date} to {target_date}...")
-
-    from sqlalchemy import text
-    with get_db_session() as session:
-        # Load flows (recent only)
-        flows_query = text("""
-            SELECT f.trade_date as date, s.code, s.name, s.market,
-                   f.foreign_net, f.trust_net, f.dealer_net
-            FROM institutional_flows f
-            JOIN stocks s ON f.stock_id = s.id
-            WHERE f.trade_date >= :start_date
-            ORDER BY s.code, f.trade_date
-        """)
-        flows_result = session.execute(flows_query, {"start_date": ratio_start_date})
-        flows_data = pd.DataFrame(flows_result.fetchall(), columns=[
-            "date", "code", "name", "market", "foreign_net", "trust_net", "dealer_net"
-        ])
-        print(f"  Loaded {len(flows_data)} flow records")
-
-        # Load foreign holdings (recent only)
-        foreign_query = text("""
-            SELECT h.trade_date as date, s.code, s.name, s.market,
-                   h.total_shares, h.foreign_shares, h.foreign_ratio
-            FROM foreign_holdings h
-            JOIN stocks s ON h.stock_id = s.id
-            WHERE h.trade_date >= :start_date
-            ORDER BY s.code, h.trade_date
-        """)
-        foreign_result = session.execute(foreign_query, {"start_date": ratio_start_date})
-        foreign_data = pd.DataFrame(foreign_result.fetchall(), columns=[
-            "date", "code", "name", "market", "total_shares", "foreign_shares", "foreign_ratio"
-        ])
-        print(f"  Loaded {len(foreign_data)} foreign holding records")
-
-    if flows_data.empty or foreign_data.empty:
-        print("  [WARN] Insufficient data for ratio computation")
-        update_etl_status("completed", f"資料更新完成，但無足夠資料計算比率 ({target_date})", is_end=True)
-        return
+    print(f"  Computing ratios from {ratio_start_date} to {target_date}...")
 
-    # Build foreign master with forward-fill
-    foreign_master = build_foreign_master(
-        foreign_data[foreign_data["market"] == "TWSE"],
-        foreign_data[foreign_data["market"] == "TPEX"]
-    )
-
-    # Load baseline
+    # Mirror baseline calibration points into the DB for the SQL anchor
     baseline = load_baseline()
+    count = sync_baselines(baseline)
     if baseline is not None:
-        print(f"  Loaded {len(baseline)} baseline records")
-
-    # Compute estimated holdings
-    merged = build_estimated_holdings(flows_data, foreign_master, baseline=baseline)
+        print(f"  Loaded {len(baseline)} baseline records ({count} stored)")
 
-    # Add change metrics
-    merged = add_change_metrics(merged, windows=settings.windows)
+    # Foreign holdings forward-fill, baseline-anchored holdings and change
+    # metrics are computed in one SQL pass
+    merged = compute_ratios_from_db(ratio_start_date)
+    if merged.empty or not (merged["total_shares"] > 0).any():
+        print("  [WARN] Insufficient data for ratio computation")
+        update_etl_status("completed", f"資料更新完成，但無足夠資料計算比率 ({target_date})", is_end=True)
+        return
+    print(f"  Computed {len(merged)} ratio records")
 
     # Upsert ratios
     count = upsert_ratios(merged)
@@ -336,7 +386,8 @@ def run_etl():
     # Compute pre-calculated strategies
     print("\n[STEP 5] Computing strategy rankings...")
     try:
-        from src.etl.processors.compute_strategy import run_all_computations
+        # 既有部署不會重跑 init.sql，由 ETL 建立 (或修復) 策略計算用的 index、資料表與 view
+        ensure_strategy_schema(engine)
         with get_db_session() as session:
             run_all_computations(session)
         print("  Strategy rankings computed successfully")
@@ -352,8 +403,16 @@ def run_etl():
 
 
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Run the institutional data ETL pipeline")
+    parser.add_argument(
+        "--no-cache",
+        action="store_true",
+        help="Ignore and do not write the on-disk fetch cache"
+    )
+    args = parser.parse_args()
+
     try:
-        run_etl()
+        run_etl(use_cache=not args.no_cache)
     except Exception as e:
         # 發生錯誤時更新狀態
         update_etl_status("error", f"更新失敗: {str(e)[:100]}", is_end=True)
@@ -6,33 +6,79 @@ and stores it in PostgreSQL.
 Waits for Main ETL to complete before starting (dependency check).
 """
 import argparse
+import select
 import time
 from datetime import datetime, date, timedelta
 from zoneinfo import ZoneInfo
 
 from sqlalchemy import text
 
-from src.common.database import get_db_session
+from src.common.database import engine, get_db_session
+from src.common.models import Stock
 from src.etl.fetchers.broker import fetch_multiple_stocks, close_browser
 from src.etl.loaders.db_loader import upsert_broker_trades
+from src.etl.stock_lists import HOT_STOCKS, TOP_50_STOCKS
+
+
+def _listen_for_etl_status():
+    """Open a dedicated connection LISTENing for Main ETL status notifications.
+
+    Returns:
+        The psycopg2 connection (close it when done), or None if LISTEN is
+        unavailable; callers then fall back to plain polling
+    """
+    try:
+        raw = engine.raw_connection()
+        conn = raw.driver_connection
+        # LISTEN 綁定在這條連線上，不放回連線池
+        raw.detach()
+        conn.autocommit = True
+        with conn.cursor() as cur:
+            # 頻道名稱見 run_all.ETL_STATUS_CHANNEL
+            cur.execute("LISTEN etl_status")
+        return conn
+    except Exception as e:
+        print(f"  [WARN] 無法 LISTEN ETL 狀態通知: {e}，改為定期檢查")
+        return None
+
+
+def _wait_for_notify(listener, timeout: float) -> None:
+    """Sleep up to timeout seconds, returning early when a notification arrives."""
+    if listener is None:
+        time.sleep(timeout)
+        return
+    if select.select([listener], [], [], timeout)[0]:
+        listener.poll()
+        listener.notifies.clear()
 
 
 def wait_for_main_etl(max_wait_minutes: int = 30, check_interval: int = 30) -> bool:
     """等待 Main ETL 完成後才開始執行。
 
+    先 LISTEN Main ETL 的完成通知再檢查狀態，執行中時一收到通知就重新檢查；
+    check_interval 只是沒有通知時的最長等待。
+
     Args:
         max_wait_minutes: 最長等待時間（分鐘）
-        check_interval: 檢查間隔（秒）
+        check_interval: 沒有通知時的檢查間隔（秒）
 
     Returns:
         True 表示可以繼續執行，False 表示應該跳過
     """
     print("[INFO] 檢查 Main ETL 狀態...")
 
-    max_wait_seconds = max_wait_minutes * 60
-    waited = 0
+    deadline = time.monotonic() + max_wait_minutes * 60
+    listener = _listen_for_etl_status()
+    try:
+        return _wait_until_etl_done(listener, deadline, max_wait_minutes, check_interval)
+    finally:
+        if listener is not None:
+            listener.close()
+
 
-    while waited < max_wait_seconds:
+def _wait_until_etl_done(listener, deadline: float, max_wait_minutes: int, check_interval: int) -> bool:
+    """Status-check loop of wait_for_main_etl."""
+    while time.monotonic() < deadline:
         try:
             with get_db_session() as session:
                 query = text("""
@@ -51,9 +97,8 @@ def wait_for_main_etl(max_wait_minutes: int = 30, check_interval: int = 30) -> b
                 completed_at = result.completed_at
 
                 if status == "running":
-                    print(f"  [WAIT] Main ETL 執行中: {message}，等待 {check_interval} 秒...")
-                    time.sleep(check_interval)
-                    waited += check_interval
+                    print(f"  [WAIT] Main ETL 執行中: {message}，等待完成通知 (最多 {check_interval} 秒)...")
+                    _wait_for_notify(listener, min(check_interval, max(0.0, deadline - time.monotonic())))
                     continue
 
                 if status == "completed":
@@ -90,78 +135,25 @@ def wait_for_main_etl(max_wait_minutes: int = 30, check_interval: int = 30) -> b
     return False
 
 
-# Hot stocks to track by default
-HOT_STOCKS = [
-    "2330",  # 台積電
-    "2317",  # 鴻海
-    "2454",  # 聯發科
-    "2412",  # 中華電
-    "2308",  # 台達電
-    "2881",  # 富邦金
-    "2882",  # 國泰金
-    "2891",  # 中信金
-    "2886",  # 兆豐金
-    "2884",  # 玉山金
-    "1301",  # 台塑
-    "1303",  # 南亞
-    "2303",  # 聯電
-    "2382",  # 廣達
-    "3008",  # 大立光
-    "2357",  # 華碩
-    "2603",  # 長榮
-    "2609",  # 陽明
-    "2615",  # 萬海
-    "3711",  # 日月光投控
-]
-
-# Top 50 stocks
-TOP_50_STOCKS = HOT_STOCKS + [
-    "2345",  # 智邦
-    "3034",  # 聯詠
-    "2379",  # 瑞昱
-    "3231",  # 緯創
-    "2395",  # 研華
-    "2327",  # 國巨
-    "3037",  # 欣興
-    "2049",  # 上銀
-    "2207",  # 和泰車
-    "1216",  # 統一
-    "2912",  # 統一超
-    "9910",  # 豐泰
-    "2474",  # 可成
-    "6669",  # 緯穎
-    "2301",  # 光寶科
-    "5871",  # 中租-KY
-    "2377",  # 微星
-    "3045",  # 台灣大
-    "4904",  # 遠傳
-    "2892",  # 第一金
-    "2880",  # 華南金
-    "5880",  # 合庫金
-    "2883",  # 開發金
-    "6505",  # 台塑化
-    "1326",  # 台化
-    "2002",  # 中鋼
-    "1402",  # 遠東新
-    "2801",  # 彰銀
-    "2890",  # 永豐金
-    "2887",  # 台新金
-]
-
-
 def get_taipei_today() -> date:
     """Get current date in Taipei timezone."""
     tz = ZoneInfo("Asia/Taipei")
     return datetime.now(tz).date()
 
 
-def run_broker_etl(stock_list: list[str] = None, delay: float = 1.5, skip_wait: bool = False):
+def run_broker_etl(
+    stock_list: list[str] = None, delay: float = 1.5, skip_wait: bool = False, max_workers: int = 1
+):
     """Run broker data ETL.
 
     Args:
         stock_list: List of stock codes to fetch (default: HOT_STOCKS)
-        delay: Delay between requests in seconds
+        delay: Delay between requests in seconds, shared by all workers
         skip_wait: Skip waiting for Main ETL (for manual runs)
+        max_workers: Number of browsers fetching concurrently (default: 1)
+
+    The shared single-worker browser is left open so later calls in the same
+    process reuse it; the entry point that owns the process closes it.
     """
     if stock_list is None:
         stock_list = HOT_STOCKS
@@ -181,27 +173,22 @@ def run_broker_etl(stock_list: list[str] = None, delay: float = 1.5, skip_wait:
     print(f"[INFO] Fetching broker data for {len(stock_list)} stocks")
     print(f"[INFO] Stocks: {', '.join(stock_list[:10])}{'...' if len(stock_list) > 10 else ''}")
 
-    try:
-        print("\n[STEP 1] Fetching broker trading data...")
-        df = fetch_multiple_stocks(stock_list, delay=delay)
-
-        if df.empty:
-            print("  [WARN] No broker data fetched")
-            return
+    print("\n[STEP 1] Fetching broker trading data...")
+    df = fetch_multiple_stocks(stock_list, delay=delay, max_workers=max_workers)
 
-        print(f"  Got {len(df)} broker records")
+    if df.empty:
+        print("  [WARN] No broker data fetched")
+        return
 
-        print("\n[STEP 2] Storing to database...")
-        count = upsert_broker_trades(df, today)
-        print(f"  Inserted {count} broker trade records")
+    print(f"  Got {len(df)} broker records")
 
-        print("\n" + "=" * 60)
-        print("[SUCCESS] Broker ETL completed!")
-        print("=" * 60)
+    print("\n[STEP 2] Storing to database...")
+    count = upsert_broker_trades(df, today)
+    print(f"  Inserted {count} broker trade records")
 
-    finally:
-        print("\n[INFO] Closing browser...")
-        close_browser()
+    print("\n" + "=" * 60)
+    print("[SUCCESS] Broker ETL completed!")
+    print("=" * 60)
 
 
 def main():
@@ -222,6 +209,12 @@ def main():
         default=1.5,
         help="Delay between requests in seconds (default: 1.5)"
     )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=1,
+        help="Number of browsers fetching concurrently; delay still applies across all of them (default: 1)"
+    )
     parser.add_argument(
         "--stocks",
         type=str,
@@ -240,8 +233,6 @@ def main():
         stock_list = args.stocks
     elif args.all:
         # Load all stocks from database
-        from src.common.database import get_db_session
-        from src.common.models import Stock
         with get_db_session() as session:
             stocks = session.query(Stock.code).filter(Stock.is_active == True).all()
             stock_list = [s[0] for s in stocks]
@@ -250,7 +241,13 @@ def main():
     else:
         stock_list = HOT_STOCKS
 
-    run_broker_etl(stock_list=stock_list, delay=args.delay, skip_wait=args.skip_wait)
+    try:
+        run_broker_etl(
+            stock_list=stock_list, delay=args.delay, skip_wait=args.skip_wait, max_workers=args.workers
+        )
+    finally:
+        print("\n[INFO] Closing browser...")
+        close_browser()
 
 
 if __name__ == "__main__":
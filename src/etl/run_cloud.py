@@ -31,13 +31,15 @@ def main():
     print("[PART 2] Running broker ETL (top 50 stocks)...")
     print("=" * 60)
     try:
-        from src.etl.run_broker import run_broker_etl, TOP_50_STOCKS, close_browser
+        from src.etl.run_broker import run_broker_etl, close_browser
+        from src.etl.stock_lists import TOP_50_STOCKS
         run_broker_etl(stock_list=TOP_50_STOCKS, delay=1.0)
     except Exception as e:
         print(f"[ERROR] Broker ETL failed: {e}")
         traceback.print_exc()
         # Don't fail entire job for broker ETL failure
     finally:
+        # 瀏覽器由這個進程入口統一關閉一次
         try:
             close_browser()
         except:
@@ -0,0 +1,59 @@
+"""Stock code lists shared by the broker ETL entry points."""
+
+# Hot stocks to track by default
+HOT_STOCKS = [
+    "2330",  # 台積電
+    "2317",  # 鴻海
+    "2454",  # 聯發科
+    "2412",  # 中華電
+    "2308",  # 台達電
+    "2881",  # 富邦金
+    "2882",  # 國泰金
+    "2891",  # 中信金
+    "2886",  # 兆豐金
+    "2884",  # 玉山金
+    "1301",  # 台塑
+    "1303",  # 南亞
+    "2303",  # 聯電
+    "2382",  # 廣達
+    "3008",  # 大立光
+    "2357",  # 華碩
+    "2603",  # 長榮
+    "2609",  # 陽明
+    "2615",  # 萬海
+    "3711",  # 日月光投控
+]
+
+# Top 50 stocks
+TOP_50_STOCKS = HOT_STOCKS + [
+    "2345",  # 智邦
+    "3034",  # 聯詠
+    "2379",  # 瑞昱
+    "3231",  # 緯創
+    "2395",  # 研華
+    "2327",  # 國巨
+    "3037",  # 欣興
+    "2049",  # 上銀
+    "2207",  # 和泰車
+    "1216",  # 統一
+    "2912",  # 統一超
+    "9910",  # 豐泰
+    "2474",  # 可成
+    "6669",  # 緯穎
+    "2301",  # 光寶科
+    "5871",  # 中租-KY
+    "2377",  # 微星
+    "3045",  # 台灣大
+    "4904",  # 遠傳
+    "2892",  # 第一金
+    "2880",  # 華南金
+    "5880",  # 合庫金
+    "2883",  # 開發金
+    "6505",  # 台塑化
+    "1326",  # 台化
+    "2002",  # 中鋼
+    "1402",  # 遠東新
+    "2801",  # 彰銀
+    "2890",  # 永豐金
+    "2887",  # 台新金
+]
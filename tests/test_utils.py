@@ -0,0 +1,21 @@
+import numpy as np
+import pandas as pd
+
+from src.common.utils import NUMERIC_CODE_RE, code_mask
+
+
+def test_code_mask_matches_valid_codes():
+    codes = pd.Series(["2330", "00631L", "0050", "合計", "123", "12345"])
+    assert code_mask(codes).tolist() == [True, True, True, False, False, True]
+
+
+def test_code_mask_numeric_pattern():
+    codes = pd.Series(["2330", "00631L"])
+    assert code_mask(codes, NUMERIC_CODE_RE).tolist() == [True, False]
+
+
+def test_code_mask_skips_missing_codes():
+    # pandas 3 keeps NaN through astype(str); blank CSV rows must not raise
+    codes = pd.Series(["2330", np.nan, None, "0050"], dtype=object)
+    assert code_mask(codes).tolist() == [True, False, False, True]
+    assert code_mask(codes.astype(str)).tolist() == [True, False, False, True]